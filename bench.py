@@ -0,0 +1,156 @@
+import argparse
+import hashlib
+import json
+import multiprocessing as mp
+import platform
+import resource
+import statistics
+import time
+
+import numpy as np
+
+import worldgen
+from misc import ProjSettings
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.
+
+
+def send_rooms(slab, grid, rooms, output):
+    """
+        Hand rooms over the way generator's workers do: write into the slab and put the slot on a queue, with the
+        time it was sent.
+    """
+    for _ in range(rooms):
+        output.put((slab.write(grid), time.perf_counter()))
+
+
+def bench_stages(dimensions, rooms, seed='bench'):
+    """
+        Time generation stages of a single room in the current thread. slab is copying a room into and out of
+        shared memory, queue is the handoff of a room from a worker process through an mp.Queue until it's taken.
+
+    :param dimensions: Room's dimensions
+    :param rooms: Amount of rooms to time
+    :param seed: World's seed
+    :return: Dict of stage name to mean seconds per room
+    """
+    width, height = dimensions
+    w_seed = worldgen.derive_seed(seed)
+    slab = worldgen.RoomSlab(1, dimensions)
+    stages = {'noise': [], 'ca': [], 'slab': [], 'queue': []}
+    try:
+        for i in range(rooms):
+            x0, y0 = i * width, 0
+            start = time.perf_counter()
+            grid = np.zeros((width + 2, height + 2), dtype=np.uint8)
+            grid[1:-1, 1:-1] = worldgen.noise(w_seed, x0, y0, x0 + width, y0 + height)
+            stages['noise'].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            worldgen.ca_smooth(grid)
+            stages['ca'].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            slab.take(slab.write(grid[1:-1, 1:-1]))
+            stages['slab'].append(time.perf_counter() - start)
+        # A single slot, so the worker waits for every room to be taken and rooms don't pile up in the queue.
+        output = mp.Queue()
+        sender = mp.Process(target=send_rooms, args=(slab, grid[1:-1, 1:-1], rooms, output), daemon=True)
+        sender.start()
+        for _ in range(rooms):
+            slot, sent = output.get()
+            slab.take(slot)
+            stages['queue'].append(time.perf_counter() - sent)
+        sender.join()
+    finally:
+        slab.close()
+    return {stage: statistics.fmean(times) for stage, times in stages.items()}
+
+
+def bench_handler(use_processes, workers, rooms, seed='bench', regions=False):
+    """
+        Generate rooms through WorldGenHandler and measure throughput and latency.
+
+    :param use_processes: Use WorldGenHandlerThread (process workers) instead of WorldGenHandlerProcess
+    :param workers: Amount of workers
+    :param rooms: Amount of rooms, generated as a square-ish rectangle
+    :param seed: World's seed
+    :param regions: Request the rectangle as a region instead of room by room
+    :return: Dict of results and a digest of generated rooms
+    """
+    ProjSettings.SimSettings.use_process_generation = use_processes
+    settings = ProjSettings.WorldSettings()
+    settings.seed = seed
+    settings.generator_processes = settings.generator_threads = workers
+    side = int(np.ceil(np.sqrt(rooms)))
+    cords = [(x, y) for x in range(side) for y in range(side)][:rooms]
+
+    generator = worldgen.WorldGenHandler(settings)
+    generator.start()
+    requested, latency, grids = {}, [], {}
+    start = time.perf_counter()
+    if regions:
+        requested = dict.fromkeys(cords, start)
+        generator.request_region(0, 0, side, side)
+    else:
+        for c in cords:
+            requested[c] = time.perf_counter()
+            generator.request(*c)
+    while len(grids) < len(requested):
+        c, slot = generator.output.get()
+        if slot is None or c not in requested:
+            continue
+        grids[c] = generator.slab.take(slot)
+        latency.append(time.perf_counter() - requested[c])
+    elapsed = time.perf_counter() - start
+    generator.halt()
+    generator.join()
+    generator.slab.close()
+
+    digest = hashlib.sha256()
+    for c in sorted(grids):
+        digest.update(grids[c].tobytes())
+    return {'handler': 'WorldGenHandlerThread' if use_processes else 'WorldGenHandlerProcess',
+            'workers': workers, 'rooms': len(grids), 'regions': regions, 'seconds': elapsed,
+            'rooms_per_second': len(grids) / elapsed, 'latency_p50': percentile(latency, 50),
+            'latency_p99': percentile(latency, 99)}, digest.hexdigest()
+
+
+def run(dimensions, workers, rooms, stage_rooms, regions):
+    ProjSettings.RoomSettings.dimensions = tuple(dimensions)
+    ProjSettings.SimSettings.use_room_cache = False
+    results = {'python': platform.python_version(), 'machine': platform.machine(), 'dimensions': list(dimensions),
+               'generator_version': worldgen.GENERATOR_VERSION,
+               'stages': bench_stages(dimensions, stage_rooms), 'handlers': []}
+    digests = set()
+    for use_processes in (True, False):
+        for amount in workers:
+            for as_region in ((False, True) if regions else (False,)):
+                result, digest = bench_handler(use_processes, amount, rooms, regions=as_region)
+                results['handlers'].append(result)
+                digests.add(digest)
+    _, digest = bench_handler(True, workers[0], rooms)
+    digests.add(digest)
+    results['deterministic'] = len(digests) == 1
+    results['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results['peak_children_rss_kb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark world generation, prints results as JSON.')
+    parser.add_argument('--dimensions', type=int, nargs=2, default=list(ProjSettings.RoomSettings.dimensions),
+                        metavar=('WIDTH', 'HEIGHT'), help="room's dimensions in tiles")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='worker amounts to try')
+    parser.add_argument('--rooms', type=int, default=400, help='rooms generated per run')
+    parser.add_argument('--stage-rooms', type=int, default=200, help='rooms used to time single stages')
+    parser.add_argument('--regions', action='store_true', help='also request rooms as regions')
+    parser.add_argument('--output', help='write results to this file instead of stdout')
+    args = parser.parse_args()
+
+    report = json.dumps(run(args.dimensions, args.workers, args.rooms, args.stage_rooms, args.regions), indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(report)
+    else:
+        print(report)
@@ -1,8 +1,276 @@
+import numpy as np
+
+from misc import ProjSettings
+from pheromones import CHANNELS
+from spatial import SpatialHash
+
+# Genome parameters, columns of AntPopulation.genome.
+GENOME = ('speed', 'turn', 'metabolism')
+FIELDS = {'key': np.int64, 'x': np.float32, 'y': np.float32, 'heading': np.float32, 'energy': np.float32,
+          'carrying': np.uint8, 'colony': np.int32, 'genome': np.float32}
 
 
 class Ant:
-    def __init__(self):
-        pass
+    """
+        View of a single ant of an AntPopulation, for inspection only; ants are simulated by AntPopulation.step().
+    """
+
+    def __init__(self, population, key):
+        self.population = population
+        self.key = key
+
+    def _get(self, field):
+        return self.population.field(field)[self.population.index[self.key]]
+
+    @property
+    def alive(self) -> bool:
+        return self.key in self.population.index
+
+    @property
+    def position(self) -> tuple[float, float]:
+        return float(self._get('x')), float(self._get('y'))
+
+    @property
+    def heading(self) -> float:
+        return float(self._get('heading'))
+
+    @property
+    def energy(self) -> float:
+        return float(self._get('energy'))
+
+    @property
+    def carrying(self) -> int:
+        return int(self._get('carrying'))
+
+    @property
+    def colony(self) -> int:
+        return int(self._get('colony'))
+
+    @property
+    def genome(self) -> dict:
+        return dict(zip(GENOME, self._get('genome').tolist()))
+
+    def __repr__(self):
+        if not self.alive:
+            return f'<Ant {self.key} (dead)>'
+        return f'<Ant {self.key} at ({self.position[0]:.1f}, {self.position[1]:.1f})>'
+
+
+class AntPopulation:
+    """
+        All ants of a world (or of a shard) as struct-of-arrays: global position in tiles, heading in radians,
+        energy, carried tile type (0 for nothing), colony and genome (see GENOME). Rows of dead ants are compacted
+        away, index maps ant's key to its row. Ants are found by position through a SpatialHash (see located()).
+    """
+
+    def __init__(self, room_dimensions, capacity=1024, seed=0, cell_size=4):
+        self.room_dimensions = tuple(room_dimensions)
+        self.settings = ProjSettings.AntSettings()
+        self.arrays = {name: np.zeros((capacity, len(GENOME)) if name == 'genome' else capacity, dtype=dtype)
+                       for name, dtype in FIELDS.items()}
+        self.size = 0
+        self.index = {}
+        self.next_key = 0
+        self.rng = np.random.default_rng(seed)
+        self.spatial = SpatialHash(cell_size)
+        self.moved = False
+
+    def __len__(self):
+        return self.size
+
+    def field(self, name) -> np.ndarray:
+        """
+            View of a field of all living ants.
+        """
+        return self.arrays[name][:self.size]
+
+    def ant(self, key) -> Ant:
+        return Ant(self, key)
+
+    def reserve(self, amount) -> None:
+        if self.size + amount <= len(self.arrays['key']):
+            return
+        capacity = max(2 * len(self.arrays['key']), self.size + amount)
+        for name, array in self.arrays.items():
+            grown = np.zeros((capacity, *array.shape[1:]), dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            self.arrays[name] = grown
+
+    def default_genome(self) -> np.ndarray:
+        return np.array([getattr(self.settings, name) for name in GENOME], dtype=np.float32)
+
+    def spawn(self, x, y, colony=0, genome=None, energy=None, heading=None) -> np.ndarray:
+        """
+            Add ants at global tile coordinates, arguments are scalars or arrays of the same length.
+
+        :param genome: Genomes of shape (n, len(GENOME)), AntSettings' genome if None
+        :return: Keys of the new ants
+        """
+        x, y = np.atleast_1d(np.asarray(x, dtype=np.float32)), np.atleast_1d(np.asarray(y, dtype=np.float32))
+        amount = len(x)
+        keys = np.arange(self.next_key, self.next_key + amount, dtype=np.int64)
+        self.next_key += amount
+        rows = {'key': keys, 'x': x, 'y': y,
+                'heading': self.rng.uniform(0, 2 * np.pi, amount) if heading is None else heading,
+                'energy': self.settings.energy if energy is None else energy, 'carrying': 0, 'colony': colony,
+                'genome': self.default_genome() if genome is None else genome}
+        self.put({name: np.broadcast_to(np.asarray(value, dtype=FIELDS[name]),
+                                        (amount, len(GENOME)) if name == 'genome' else (amount,))
+                  for name, value in rows.items()})
+        return keys
+
+    def rows(self, keys=None) -> dict:
+        """
+            Copy of ants' fields, all ants if keys is None; see put().
+        """
+        if keys is None:
+            return {name: array[:self.size].copy() for name, array in self.arrays.items()}
+        rows = np.array([self.index[key] for key in keys], dtype=np.int64)
+        return {name: array[rows] for name, array in self.arrays.items()}
+
+    def put(self, rows) -> None:
+        """
+            Add or overwrite ants with fields made by rows().
+        """
+        keys = rows['key'].tolist()
+        existing = np.array([self.index.get(key, -1) for key in keys], dtype=np.int64)
+        new = np.flatnonzero(existing < 0)
+        self.reserve(len(new))
+        existing[new] = np.arange(self.size, self.size + len(new))
+        for name, array in self.arrays.items():
+            array[existing] = rows[name]
+        self.index.update(zip((keys[i] for i in new.tolist()), existing[new].tolist()))
+        self.size += len(new)
+        self.moved = True
+        if keys:
+            self.next_key = max(self.next_key, max(keys) + 1)
+
+    def remove(self, keys) -> None:
+        rows = [self.index[key] for key in keys if key in self.index]
+        if not rows:
+            return
+        keep = np.ones(self.size, dtype=bool)
+        keep[rows] = False
+        size = int(keep.sum())
+        for array in self.arrays.values():
+            array[:size] = array[:self.size][keep]
+        self.size = size
+        self.moved = True
+        self.index = dict(zip(self.arrays['key'][:size].tolist(), range(size)))
+
+    def located(self) -> SpatialHash:
+        """
+            Spatial index of living ants, ants' group is their colony. Refreshed on access after ants moved.
+        """
+        if self.moved:
+            self.spatial.sync(self.field('key'), self.field('x'), self.field('y'), self.field('colony'))
+            self.moved = False
+        return self.spatial
+
+    def near(self, points, radius, colony=None, exclude=None):
+        """
+            Ants within radius of many points, see SpatialHash.radius().
+        """
+        return self.located().radius(points, radius, colony, exclude)
+
+    def nearest(self, points, k, max_radius=None, colony=None, exclude=None):
+        """
+            k nearest ants of many points, see SpatialHash.nearest().
+        """
+        return self.located().nearest(points, k, max_radius, colony, exclude)
+
+    def rooms(self) -> np.ndarray:
+        """
+            Cords of every ant's room, shape (n, 2).
+        """
+        width, height = self.room_dimensions
+        return np.stack([np.floor(self.field('x') / width), np.floor(self.field('y') / height)],
+                        axis=1).astype(np.int64)
+
+    def in_room(self, cords) -> list:
+        """
+            Keys of ants in a room.
+        """
+        rooms = self.rooms()
+        return self.field('key')[(rooms[:, 0] == cords[0]) & (rooms[:, 1] == cords[1])].tolist()
+
+    def step(self, world, tick, simulated) -> None:
+        """
+            Advance ants of simulated rooms by one tick: wander, turn towards the strongest trail they sense (home
+            trail when carrying, food trail otherwise), walk (slower on costly tiles, turning around at tiles that
+            can't be walked on), mark their way with the other trail, spend energy and die when it runs out.
+            Ants in crowded rooms only move every third tick. Ants crossing into another room are moved by
+            world.migrate(), ants that can't move there turn around.
+
+        :param world: World or Shard, provides rooms, pheromones, neighbourhood() and migrate()
+        :param tick: Current tick
+        :param simulated: Cords of rooms being simulated
+        """
+        if not self.size or not simulated:
+            return
+        rooms = self.rooms()
+        _, first, inverse, counts = np.unique(rooms[:, 0] * 2 ** 32 + rooms[:, 1], return_index=True,
+                                              return_inverse=True, return_counts=True)
+        unique = rooms[first]
+        moving = np.zeros(len(unique), dtype=bool)
+        for i, cords in enumerate(map(tuple, unique.tolist())):
+            room = world.rooms.get(cords)
+            if cords not in simulated or not hasattr(room, 'settings'):
+                continue
+            # Crowded rooms update their ants only every third tick.
+            moving[i] = counts[i] / room.settings.max_ants < room.settings.ant_halt or not tick % 3
+        selected = np.flatnonzero(moving[inverse])
+        if not len(selected):
+            return
+        x, y, heading = self.field('x'), self.field('y'), self.field('heading')
+        genome = self.field('genome')[selected]
+        speed, turn, metabolism = genome[:, 0], genome[:, 1], genome[:, 2]
+
+        heading[selected] += self.rng.uniform(-1, 1, len(selected)).astype(np.float32) * turn
+        carrying = self.field('carrying')[selected] > 0
+        sensors = np.array([-self.settings.sensor_angle, 0, self.settings.sensor_angle], dtype=np.float32)
+        angles = heading[selected][:, None] + sensors
+        ahead = np.stack([x[selected][:, None] + np.cos(angles) * self.settings.sensor_distance,
+                          y[selected][:, None] + np.sin(angles) * self.settings.sensor_distance], axis=-1)
+        wanted = np.where(carrying, CHANNELS.index('home'), CHANNELS.index('food'))
+        smell = world.pheromones.sample(np.floor(ahead).reshape(-1, 2), np.repeat(wanted, len(sensors)))
+        smell = smell.reshape(-1, len(sensors))
+        heading[selected] += np.where(smell.max(axis=1) > 0, sensors[smell.argmax(axis=1)] * self.settings.follow, 0)
+        dx, dy = np.cos(heading[selected]) * speed, np.sin(heading[selected]) * speed
+        tx, ty = x[selected] + dx, y[selected] + dy
+        cost = world.neighbourhood(np.stack([np.floor(tx), np.floor(ty)], axis=1), 'cost', 0)[:, 0, 0]
+        blocked = cost == 0
+        cost = np.maximum(cost, 1).astype(np.float32)
+        old_x, old_y = x[selected], y[selected]
+        x[selected] = np.where(blocked, old_x, old_x + dx / cost)
+        y[selected] = np.where(blocked, old_y, old_y + dy / cost)
+        heading[selected] = np.where(blocked, heading[selected] + np.pi, heading[selected]) % (2 * np.pi)
+        self.field('energy')[selected] -= metabolism
+        self.moved = True
+
+        width, height = self.room_dimensions
+        new_rooms = np.stack([np.floor(x[selected] / width), np.floor(y[selected] / height)], axis=1).astype(np.int64)
+        crossing = np.flatnonzero((new_rooms != rooms[selected]).any(axis=1))
+        keys = self.field('key')
+        for i in crossing.tolist():
+            row = selected[i]
+            if not world.migrate(tuple(rooms[row].tolist()), int(keys[row]), tuple(new_rooms[i].tolist())):
+                x[row], y[row] = old_x[i], old_y[i]
+                heading[row] = (heading[row] + np.pi) % (2 * np.pi)
+
+        # Only rooms simulated here keep pheromones, ants that just left for another shard's room don't mark.
+        tiles = np.floor(np.stack([x[selected], y[selected]], axis=1)).astype(np.int64)
+        codes = (tiles[:, 0] // width) * 2 ** 32 + tiles[:, 1] // height
+        inside = np.isin(codes, np.array([cx * 2 ** 32 + cy for cx, cy in simulated], dtype=np.int64))
+        world.pheromones.deposit(tiles[inside], np.where(carrying, CHANNELS.index('food'),
+                                                         CHANNELS.index('home'))[inside], self.settings.deposit)
 
-    def update(self):
-        pass
\ No newline at end of file
+        dead = selected[self.field('energy')[selected] <= 0]
+        if len(dead):
+            rooms = self.rooms()
+            for row in dead.tolist():
+                room = world.rooms.get(tuple(rooms[row].tolist()))
+                if hasattr(room, 'ants'):
+                    room.ants.pop(int(keys[row]), None)
+                    room.mark_dirty()
+            self.remove(keys[dead].tolist())
@@ -1,20 +1,53 @@
-import multiprocessing as mp
+import argparse
+import time
 
 from misc import ProjSettings
 from world import World
 
 
-class LogicProcess(mp.Process):
-    def __init__(self):
-        super().__init__()
+def run_headless(seconds=None, area=3, tick_rate=0., processes=0):
+    """
+        Run the simulation without rendering; no pygame or win32 modules are imported.
+
+    :param seconds: How long to run, until interrupted if None
+    :param area: Side of the square of rooms around (0, 0) that is generated and simulated
+    :param tick_rate: Ticks per second, 0 for as fast as possible
+    :param processes: Amount of simulation processes (see sharding.ShardedSimulation), 0 to simulate in a thread
+    """
+    sim_settings = ProjSettings.SimSettings()
+    sim_settings.tick_rate = tick_rate
+    sim_settings.simulation_processes = processes
+    world = World(sim_settings, ProjSettings.WorldSettings())
+    world.get_rooms([(x, y) for x in range(area) for y in range(area)])
+    start = time.perf_counter()
+    try:
+        while seconds is None or time.perf_counter() - start < seconds:
+            time.sleep(max(0., min(1., seconds - (time.perf_counter() - start))) if seconds else 1.)
+            print(world.updater.timings())
+    except KeyboardInterrupt:
+        pass
+    world.quit()
 
 
 if __name__ == '__main__':
-    from ui.rendering import RenderThread
-    world = World(ProjSettings.SimSettings(), ProjSettings.WorldSettings())
-    rendering = RenderThread(world)
-    rendering.start()
-    rendering.join()
-    world.save()
-    world.quit()
-    pass
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Antsy-World')
+    parser.add_argument('--headless', action='store_true', help='run the simulation without rendering')
+    parser.add_argument('--seconds', type=float, help='headless: stop after this many seconds')
+    parser.add_argument('--area', type=int, default=3, help='headless: side of the simulated square of rooms')
+    parser.add_argument('--tick-rate', type=float, default=0., help='headless: ticks per second, 0 is uncapped')
+    parser.add_argument('--processes', type=int, default=ProjSettings.SimSettings.simulation_processes,
+                        help='simulation processes, 0 simulates in a thread')
+    args = parser.parse_args()
+
+    if args.headless:
+        run_headless(args.seconds, args.area, args.tick_rate, args.processes)
+    else:
+        from ui.rendering import RenderThread
+        sim_settings = ProjSettings.SimSettings()
+        sim_settings.simulation_processes = args.processes
+        world = World(sim_settings, ProjSettings.WorldSettings())
+        rendering = RenderThread(world)
+        rendering.start()
+        rendering.join()
+        world.save()
+        world.quit()
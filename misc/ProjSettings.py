@@ -1,12 +1,14 @@
 import datetime
 import uuid
-from win32api import GetSystemMetrics
+from functools import cache
 
 
 class WorldSettings:
     dimensions: tuple[int, int] = (250, 250)
     generator_processes: int = 3
     generator_threads: int = 5
+    region_block: int = 8
+    save_region_size: int = 16
     portals: int = 2
     starting_colonies: int = 3
     name: str = str(uuid.uuid4())
@@ -65,7 +67,41 @@ class TileSettings:
 class EmptyTile(TileSettings):
     interactable = False
     tick_logic = False
+    walkable = True
     walk_cost = 1
+    color: tuple[int, int, int] = (46, 36, 28)
+
+
+class MaterialTile(EmptyTile):
+    walkable = False
+    color = (140, 120, 80)
+
+
+class RockTile(EmptyTile):
+    walkable = False
+    color = (96, 96, 100)
+
+
+class FoodTile(EmptyTile):
+    flow_radius = 1
+    color = (70, 160, 60)
+
+
+class NestTile(EmptyTile):
+    flow_radius = 2
+    color = (160, 80, 40)
+
+
+class AntSettings:
+    speed: float = .5
+    turn: float = .3
+    metabolism: float = .0005
+    energy: float = 1.
+    # Pheromones (see pheromones.CHANNELS) are sensed at sensor_distance ahead, sensor_angle to the sides.
+    sensor_distance: float = 2.
+    sensor_angle: float = .6
+    follow: float = .4
+    deposit: float = .5
 
 
 class SimSettings:
@@ -73,16 +109,61 @@ class SimSettings:
     portal_time: int = 10000
     use_process_generation: bool = True
     use_smart_request_distributor: bool = False
+    request_distributor_capacity: int = 16
+    request_drop_distance: int = 4
+    transport_slots: int = 1024
+    use_room_cache: bool = True
+    room_cache_size: int = 256 * 2 ** 20
+    max_events: int = 10000
+    autosave_interval: float = 60.
+    evict_interval: float = 1.
+    colony_radius: int = 2
+    ant_radius: int = 1
+    camera_radius: int = 1
+    max_resident_rooms: int = 4096
+    max_resident_bytes: int | None = None
+    tick_rate: float = 30.
+    simulation_processes: int = 0
+    shard_block: int = 4
+    ghost_width: int = 1
+    spatial_cell: int = 4
+    path_cache_rooms: int = 1024
+    max_flow_fields: int = 64
+    pheromone_diffusion: float = .2
+    pheromone_evaporation: float = .01
+    pheromone_threshold: float = 1e-3
     name: str = datetime.datetime.now().strftime('%d.%m.%Y %H-%M-%S')
     room_settings = RoomSettings()
 
 
+@cache
+def _screen_resolution() -> tuple[int, int]:
+    try:
+        from win32api import GetSystemMetrics
+    except ImportError:
+        return RenderingSettings.window_size
+    return GetSystemMetrics(0), GetSystemMetrics(1)
+
+
+class _ScreenResolution:
+    """
+        Screen's resolution, read from the system only when it's first needed, so settings can be imported
+        without win32 (headless runs, other platforms).
+    """
+
+    def __get__(self, instance, owner) -> tuple[int, int]:
+        return _screen_resolution()
+
+
 class RenderingSettings:
     rendering_distance: int = 10
     framerate: int = 30
     fullscreen: bool = False
     window_size: tuple[int, int] = (1000, 1000)
-    resolution: tuple[int, int] = (GetSystemMetrics(0), GetSystemMetrics(1))
+    resolution: tuple[int, int] = _ScreenResolution()
     room_size: tuple[int, int] = (RoomSettings.dimensions[0] * TileSettings.dimensions[0],
                                   RoomSettings.dimensions[1] * TileSettings.dimensions[1])
     resizable: bool = True
+    zoom_step: float = .25
+    wall_color: tuple[int, int, int] = (18, 14, 10)
+    room_cache_bytes: int = 256 * 2 ** 20
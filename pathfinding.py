@@ -0,0 +1,390 @@
+import heapq
+import itertools
+from collections import OrderedDict
+
+import numpy as np
+
+# Directions to the 4 neighbouring tiles (and rooms).
+DIRECTIONS = [(1, 0), (-1, 0), (0, 1), (0, -1)]
+
+
+def relax(cost, dist, fixed) -> np.ndarray:
+    """
+        Lower distance fields until no tile can be reached more cheaply through a 4-neighbour; a step costs the walk
+        cost of the tile it enters. Values of dist have to be upper bounds (inf is always fine), so a field can be
+        relaxed again from its old values after tiles got cheaper.
+
+    :param cost: Walk costs of shape (width, height), 0 for tiles that can't be walked on
+    :param dist: float32 array of shape (n, width, height)
+    :param fixed: Mask of sources, kept at 0, broadcastable to dist
+    :return: Relaxed dist
+    """
+    step = np.where(cost > 0, cost, np.inf).astype(np.float32)
+    blocked = cost == 0
+    while True:
+        entered = dist + step
+        best = dist.copy()
+        np.minimum(best[:, 1:], entered[:, :-1], out=best[:, 1:])
+        np.minimum(best[:, :-1], entered[:, 1:], out=best[:, :-1])
+        np.minimum(best[:, :, 1:], entered[:, :, :-1], out=best[:, :, 1:])
+        np.minimum(best[:, :, :-1], entered[:, :, 1:], out=best[:, :, :-1])
+        best[:, blocked] = np.inf
+        np.copyto(best, 0, where=fixed)
+        if np.array_equal(best, dist):
+            return dist
+        dist = best
+
+
+def distance_field(cost, sources) -> np.ndarray:
+    """
+        Cost of travelling from every tile to each of the sources, all sources are relaxed together as one array.
+
+    :param cost: Walk costs of shape (width, height), 0 for tiles that can't be walked on
+    :param sources: Local (x, y) tiles, shape (n, 2)
+    :return: float32 array of shape (n, width, height), inf for tiles that can't reach the source
+    """
+    sources = np.asarray(sources, dtype=np.int64).reshape(-1, 2)
+    fixed = np.zeros((len(sources), *cost.shape), dtype=bool)
+    fixed[np.arange(len(sources)), sources[:, 0], sources[:, 1]] = True
+    return relax(cost, np.where(fixed, 0, np.inf).astype(np.float32), fixed)
+
+
+def descend(field, cost, start) -> list[tuple[int, int]]:
+    """
+        Follow a distance field from a local tile down to its source.
+
+    :return: Local tiles after start up to and including the source
+    """
+    width, height = cost.shape
+    path, (x, y) = [], start
+    while field[x, y] > 0:
+        options = [(field[x + dx, y + dy] + cost[x + dx, y + dy], (x + dx, y + dy)) for dx, dy in DIRECTIONS
+                   if 0 <= x + dx < width and 0 <= y + dy < height and cost[x + dx, y + dy]]
+        _, (x, y) = min(options)
+        path.append((x, y))
+    return path
+
+
+def entrances(cost, neighbour_cost, direction) -> list[tuple[tuple[int, int], tuple[int, int]]]:
+    """
+        Portals on the border between a room and its neighbour in direction. Every run of tiles open on both
+        sides gets a portal in its middle, long runs get one at each end.
+
+    :return: Local tile of the portal in the room and in the neighbour
+    """
+    width, height = cost.shape
+    dx, dy = direction
+    if dx:
+        own, other = (width - 1, 0) if dx > 0 else (0, width - 1)
+        open_ = (cost[own, :] > 0) & (neighbour_cost[other, :] > 0)
+        tile = lambda i: ((own, i), (other, i))
+    else:
+        own, other = (height - 1, 0) if dy > 0 else (0, height - 1)
+        open_ = (cost[:, own] > 0) & (neighbour_cost[:, other] > 0)
+        tile = lambda i: ((i, own), (i, other))
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], open_.astype(np.int8), [0]])))
+    output = []
+    for start, end in zip(edges[::2].tolist(), edges[1::2].tolist()):
+        if end - start <= 5:
+            output.append(tile((start + end - 1) // 2))
+        else:
+            output += [tile(start), tile(end - 1)]
+    return output
+
+
+class RoomGraph:
+    """
+        Cached abstract graph of a single room: its portals, distance fields to every portal and portals' partners
+        across the borders. Valid as long as versions of the room's and its neighbours' tiles don't change.
+    """
+
+    def __init__(self, key, origin, cost, portals, partners):
+        self.key = key
+        self.origin = origin
+        self.cost = cost
+        self.portals = portals
+        self.index = {portal: i for i, portal in enumerate(portals)}
+        self.partners = partners
+        self.fields = distance_field(cost, portals) if portals else np.zeros((0, *cost.shape), dtype=np.float32)
+        self.nodes = [(origin[0] + x, origin[1] + y) for x, y in portals]
+        # Edges of every portal: to other portals of the room and to partners.
+        self.links = [list(partners[portal]) + self.reachable(portal) for portal in portals]
+
+    def reachable(self, local) -> list[tuple[tuple[int, int], float]]:
+        """
+            Portals reachable from a local tile and travel costs to them.
+        """
+        return [(node, cost) for node, cost in zip(self.nodes, self.fields[:, local[0], local[1]].tolist())
+                if cost != np.inf and node != (self.origin[0] + local[0], self.origin[1] + local[1])]
+
+
+class Pathfinder:
+    """
+        Hierarchical pathfinder over rooms. Rooms are clusters: portals are placed on their borders, distances
+        between portals of a room are cached, long trips are searched with A* over portals and only rooms the
+        path crosses are refined into tiles. Tiles can't be walked on if their walk cost is 0 or if they're
+        layout's walls (see Room.field('cost')).
+        Room graphs are rebuilt when the tiles of the room or of its neighbours change, at most max_rooms graphs
+        are kept.
+    """
+
+    def __init__(self, world, max_rooms=1024):
+        self.world = world
+        self.max_rooms = max_rooms
+        self.graphs: OrderedDict[tuple[int, int], RoomGraph] = OrderedDict()
+
+    def graph(self, cords) -> RoomGraph | None:
+        room = self.world.get_room(cords)
+        if room is None:
+            return None
+        neighbours = [self.world.get_room((cords[0] + dx, cords[1] + dy)) for dx, dy in DIRECTIONS]
+        key = (room.tiles.version, *(None if n is None else n.tiles.version for n in neighbours))
+        graph = self.graphs.get(cords)
+        if graph is not None and graph.key == key:
+            self.graphs.move_to_end(cords)
+            return graph
+
+        width, height = room.settings.dimensions
+        origin = (cords[0] * width, cords[1] * height)
+        cost = room.field('cost')
+        partners = {}
+        for (dx, dy), neighbour in zip(DIRECTIONS, neighbours):
+            if neighbour is None:
+                continue
+            neighbour_cost = neighbour.field('cost')
+            for own, other in entrances(cost, neighbour_cost, (dx, dy)):
+                partner = (origin[0] + dx * width + other[0], origin[1] + dy * height + other[1])
+                partners.setdefault(own, []).append((partner, float(neighbour_cost[other])))
+        graph = self.graphs[cords] = RoomGraph(key, origin, cost, sorted(partners), partners)
+        self.graphs.move_to_end(cords)
+        while len(self.graphs) > self.max_rooms:
+            self.graphs.popitem(last=False)
+        return graph
+
+    def find_path(self, start, goal, max_nodes=100000) -> list[tuple[int, int]] | None:
+        """
+            Path between global tiles.
+
+        :param max_nodes: Give up after expanding this many portals
+        :return: Global tiles from start to goal (both included) or None if there's no path
+        """
+        start, goal = tuple(map(int, start)), tuple(map(int, goal))
+        start_room, start_local = self.world.locate(*start)
+        goal_room, goal_local = self.world.locate(*goal)
+        start_graph, goal_graph = self.graph(start_room), self.graph(goal_room)
+        if start_graph is None or goal_graph is None or not start_graph.cost[start_local] or \
+                not goal_graph.cost[goal_local]:
+            return None
+        # Travelling to a tile costs as much as travelling back from it, less the start's and plus the goal's cost.
+        to_goal = (goal_graph.fields[:, goal_local[0], goal_local[1]] + float(goal_graph.cost[goal_local]) -
+                   goal_graph.cost[tuple(np.array(goal_graph.portals, dtype=np.int64).reshape(-1, 2).T)]).tolist()
+        direct = None
+        if start_room == goal_room:
+            direct = float(distance_field(goal_graph.cost, [goal_local])[0][start_local])
+
+        # Graphs are validated once per search.
+        graphs = {start_room: start_graph, goal_room: goal_graph}
+
+        def edges(node):
+            room, local = self.world.locate(*node)
+            if room not in graphs:
+                graphs[room] = self.graph(room)
+            graph = graphs[room]
+            if local in graph.index:
+                links = graph.links[graph.index[local]]
+                if room == goal_room and to_goal[graph.index[local]] != np.inf:
+                    return links + [(goal, to_goal[graph.index[local]])]
+                return links
+            links = graph.reachable(local)
+            if direct is not None and direct != np.inf:
+                return links + [(goal, direct)]
+            return links
+
+        counter = itertools.count()
+        heuristic = lambda node: abs(node[0] - goal[0]) + abs(node[1] - goal[1])
+        queue = [(heuristic(start), 0., next(counter), start)]
+        costs, parents = {start: 0.}, {start: None}
+        expanded = 0
+        while queue:
+            _, cost, _, node = heapq.heappop(queue)
+            if node == goal:
+                break
+            if cost > costs[node]:
+                continue
+            expanded += 1
+            if expanded > max_nodes:
+                return None
+            for neighbour, step in edges(node):
+                step += cost
+                if step < costs.get(neighbour, np.inf):
+                    costs[neighbour], parents[neighbour] = step, node
+                    heapq.heappush(queue, (step + heuristic(neighbour), step, next(counter), neighbour))
+        else:
+            return None
+
+        nodes = [goal]
+        while parents[nodes[-1]] is not None:
+            nodes.append(parents[nodes[-1]])
+        return self.refine(nodes[::-1])
+
+    def refine(self, nodes) -> list[tuple[int, int]]:
+        """
+            Turn a path over portals into tiles, only rooms on the path are touched.
+        """
+        path = [nodes[0]]
+        for node, target in zip(nodes, nodes[1:]):
+            room, local = self.world.locate(*node)
+            target_room, target_local = self.world.locate(*target)
+            if room != target_room:
+                path.append(target)
+                continue
+            graph = self.graph(room)
+            if target_local in graph.index:
+                tiles = descend(graph.fields[graph.index[target_local]], graph.cost, local)
+            elif local in graph.index:
+                # Portal to the goal, walk the portal's field back from the goal.
+                tiles = [target_local] + descend(graph.fields[graph.index[local]], graph.cost, target_local)
+                tiles = tiles[::-1][1:]
+            else:
+                tiles = descend(distance_field(graph.cost, [target_local])[0], graph.cost, local)
+            path += [(graph.origin[0] + x, graph.origin[1] + y) for x, y in tiles]
+        return path
+
+
+class FlowField:
+    """
+        Travel costs from every tile of an area to the nearest of the goals and the step to take from every tile,
+        shared by all ants heading to the same goals. The area covers rooms within radius rooms of the goals' rooms.
+        refresh() updates the field after tiles of its rooms change: tiles whose way to the goal led through tiles
+        that got more expensive are reset, then the field is relaxed from its old values.
+    """
+
+    def __init__(self, world, goals, radius=1):
+        self.world = world
+        self.goals = sorted(set(map(tuple, goals)))
+        width, height = world.sim_settings.room_settings.dimensions
+        rooms = [world.locate(*goal)[0] for goal in self.goals]
+        self.room_area = (min(c[0] for c in rooms) - radius, min(c[1] for c in rooms) - radius,
+                          max(c[0] for c in rooms) + radius + 1, max(c[1] for c in rooms) + radius + 1)
+        x0, y0, x1, y1 = self.room_area
+        self.origin = (x0 * width, y0 * height)
+        self.shape = ((x1 - x0) * width, (y1 - y0) * height)
+        self.fixed = np.zeros((1, *self.shape), dtype=bool)
+        for x, y in self.goals:
+            self.fixed[0, x - self.origin[0], y - self.origin[1]] = True
+        self.versions = self.room_versions()
+        self.cost = self.read_cost()
+        self.dist = relax(self.cost, np.where(self.fixed, 0, np.inf).astype(np.float32), self.fixed)[0]
+        self.steps = self.directions()
+
+    def room_versions(self) -> dict:
+        x0, y0, x1, y1 = self.room_area
+        versions = {}
+        for cords in ((x, y) for x in range(x0, x1) for y in range(y0, y1)):
+            room = self.world.get_room(cords)
+            versions[cords] = None if room is None else room.tiles.version
+        return versions
+
+    def read_cost(self) -> np.ndarray:
+        return self.world.region(*self.origin, self.origin[0] + self.shape[0], self.origin[1] + self.shape[1],
+                                 'cost', 0)
+
+    def directions(self) -> np.ndarray:
+        """
+            Index in DIRECTIONS of the cheapest step from every tile, -1 at goals and tiles that can't reach them.
+        """
+        entered = np.pad(self.dist + np.where(self.cost > 0, self.cost, np.inf), 1, constant_values=np.inf)
+        width, height = self.shape
+        options = np.stack([entered[1 + dx:1 + dx + width, 1 + dy:1 + dy + height] for dx, dy in DIRECTIONS])
+        steps = np.argmin(options, axis=0).astype(np.int8)
+        steps[(self.dist == 0) | ~np.isfinite(self.dist) | ~np.isfinite(options.min(axis=0))] = -1
+        return steps
+
+    def refresh(self) -> bool:
+        """
+            Update the field if tiles of its rooms changed.
+
+        :return: Whether the field changed
+        """
+        versions = self.room_versions()
+        if versions == self.versions:
+            return False
+        self.versions = versions
+        cost = self.read_cost()
+        old = np.where(self.cost > 0, self.cost, np.inf)
+        new = np.where(cost > 0, cost, np.inf)
+        # Tiles whose cheapest way to the goals runs through a tile that got more expensive.
+        affected = new > old
+        flat = self.steps.reshape(-1).astype(np.int64)
+        width, height = self.shape
+        offsets = np.array([dx * height + dy for dx, dy in DIRECTIONS], dtype=np.int64)
+        following = np.where(flat >= 0, np.arange(flat.size) + offsets[flat], 0)
+        while True:
+            grown = affected.reshape(-1) | ((flat >= 0) & affected.reshape(-1)[following])
+            if np.array_equal(grown, affected.reshape(-1)):
+                break
+            affected = grown.reshape(self.shape)
+        self.cost = cost
+        dist = np.where(affected, np.inf, self.dist).astype(np.float32)[None]
+        self.dist = relax(self.cost, dist, self.fixed)[0]
+        self.steps = self.directions()
+        return True
+
+    def step(self, x, y) -> tuple[int, int] | None:
+        """
+            Step to take from a global tile towards the goals, None at the goals, outside of the area and from tiles
+            that can't reach them.
+        """
+        lx, ly = x - self.origin[0], y - self.origin[1]
+        if not (0 <= lx < self.shape[0] and 0 <= ly < self.shape[1]) or self.steps[lx, ly] < 0:
+            return None
+        return DIRECTIONS[self.steps[lx, ly]]
+
+    def steps_at(self, points) -> np.ndarray:
+        """
+            Steps of many global tiles at once, (0, 0) where step() would return None.
+
+        :param points: Array of global (x, y) tiles, shape (n, 2)
+        :return: Array of shape (n, 2)
+        """
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        lx, ly = points[:, 0] - self.origin[0], points[:, 1] - self.origin[1]
+        inside = (lx >= 0) & (lx < self.shape[0]) & (ly >= 0) & (ly < self.shape[1])
+        steps = np.full(len(points), -1, dtype=np.int64)
+        steps[inside] = self.steps[lx[inside], ly[inside]]
+        return np.vstack([np.array(DIRECTIONS, dtype=np.int64), [[0, 0]]])[steps]
+
+    def distance(self, x, y) -> float:
+        lx, ly = x - self.origin[0], y - self.origin[1]
+        if not (0 <= lx < self.shape[0] and 0 <= ly < self.shape[1]):
+            return np.inf
+        return float(self.dist[lx, ly])
+
+
+class FlowFields:
+    """
+        Cache of flow fields by goals, fields are refreshed when they're requested; at most max_fields are kept.
+    """
+
+    def __init__(self, world, max_fields=64):
+        self.world = world
+        self.max_fields = max_fields
+        self.fields: OrderedDict[tuple, FlowField] = OrderedDict()
+
+    def toward(self, goals, radius=1) -> FlowField:
+        """
+            Flow field towards the nearest of the goals.
+
+        :param goals: Global (x, y) tiles
+        :param radius: Rooms around the goals' rooms covered by the field
+        """
+        key = (tuple(sorted(set(map(tuple, goals)))), radius)
+        field = self.fields.get(key)
+        if field is None:
+            field = self.fields[key] = FlowField(self.world, key[0], radius)
+        else:
+            field.refresh()
+        self.fields.move_to_end(key)
+        while len(self.fields) > self.max_fields:
+            self.fields.popitem(last=False)
+        return field
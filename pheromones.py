@@ -0,0 +1,189 @@
+import numpy as np
+
+# Pheromone channels of the chemical language.
+CHANNELS = ('home', 'food', 'alarm')
+# Directions to the 4 neighbouring rooms and the slices of a room's edge facing them.
+EDGES = {(1, 0): (slice(-1, None), slice(None)), (-1, 0): (slice(0, 1), slice(None)),
+         (0, 1): (slice(None), slice(-1, None)), (0, -1): (slice(None), slice(0, 1))}
+
+
+def by_room(points, dimensions):
+    """
+        Group global tiles by room.
+
+    :param points: Array of global (x, y) tiles, shape (n, 2)
+    :return: List of room's cords, indices of its points and their local x and y
+    """
+    width, height = dimensions
+    rx, ry = points[:, 0] // width, points[:, 1] // height
+    codes = rx * 2 ** 32 + ry
+    order = np.argsort(codes)
+    codes = codes[order]
+    bounds = np.flatnonzero(np.concatenate([[True], codes[1:] != codes[:-1], [True]]))
+    groups = []
+    for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        selected = order[start:end]
+        x, y = int(rx[selected[0]]), int(ry[selected[0]])
+        groups.append(((x, y), selected, points[selected, 0] - x * width, points[selected, 1] - y * height))
+    return groups
+
+
+class PheromoneField:
+    """
+        Pheromones of a single room, one float32 layer per channel. Steps read front and write back, then swap.
+    """
+
+    def __init__(self, channels, dimensions, tick=0):
+        self.front = np.zeros((channels, *dimensions), dtype=np.float32)
+        self.back = np.zeros_like(self.front)
+        self.tick = tick
+
+    def swap(self) -> None:
+        self.front, self.back = self.back, self.front
+
+
+class Pheromones:
+    """
+        World's pheromone layer. Only rooms that hold pheromones have a field, a field is dropped once all of its
+        pheromones evaporate below threshold, and is created when pheromones are deposited or flow into the room.
+        Every tick, fields of simulated rooms diffuse to their 4-neighbours' fields, across room borders as well,
+        and evaporate. Borders with rooms without a field act as walls until the room's field is woken, so no
+        pheromones are lost at them; fields of rooms that weren't simulated only evaporate for the ticks they missed.
+        ghosts hold edges of fields of neighbouring rooms simulated elsewhere (other shards), read-only and sent at
+        every tick boundary; both sides compute the flux between them from the same values, so none is lost or made
+        up. Only dropping a field below threshold loses pheromones.
+    """
+
+    def __init__(self, room_dimensions, diffusion=.2, evaporation=.01, threshold=1e-3):
+        self.dimensions = tuple(room_dimensions)
+        self.diffusion = diffusion
+        self.evaporation = evaporation
+        self.threshold = threshold
+        self.fields: dict[tuple[int, int], PheromoneField] = {}
+        self.ghosts: dict[tuple[int, int], np.ndarray] = {}
+        self.tick = 0
+
+    def field(self, cords) -> PheromoneField:
+        if cords not in self.fields:
+            self.fields[cords] = PheromoneField(len(CHANNELS), self.dimensions, self.tick)
+        return self.fields[cords]
+
+    def ghost(self, cords) -> np.ndarray:
+        if cords not in self.ghosts:
+            self.ghosts[cords] = np.zeros((len(CHANNELS), *self.dimensions), dtype=np.float32)
+        return self.ghosts[cords]
+
+    def catch_up(self, field, tick) -> None:
+        """
+            Evaporate pheromones of a field for the ticks it wasn't stepped before tick.
+        """
+        if tick - field.tick > 1:
+            field.front *= (1 - self.evaporation) ** (tick - field.tick - 1)
+            field.tick = tick - 1
+
+    def take(self, cords):
+        """
+            Remove a room's pheromones, see put().
+
+        :return: Room's pheromones as an array or None
+        """
+        field = self.fields.pop(cords, None)
+        if field is None:
+            return None
+        self.catch_up(field, self.tick + 1)
+        return field.front
+
+    def put(self, cords, pheromones, tick=None) -> None:
+        """
+            Give a room pheromones made by take().
+
+        :param tick: Tick the pheromones were taken at, they evaporate for the ticks since then on the next step
+        """
+        if pheromones is not None:
+            field = self.field(cords)
+            field.front[:] = pheromones
+            if tick is not None:
+                field.tick = tick
+
+    def deposit(self, points, channels, amounts) -> None:
+        """
+            Add pheromones at global tiles.
+
+        :param points: Array of global (x, y) tiles, shape (n, 2)
+        :param channels: Channel index (see CHANNELS) per point or for all points
+        :param amounts: Amount per point or for all points
+        """
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        channels = np.broadcast_to(np.asarray(channels, dtype=np.int64), len(points))
+        amounts = np.broadcast_to(np.asarray(amounts, dtype=np.float32), len(points))
+        for cords, selected, lx, ly in by_room(points, self.dimensions):
+            np.add.at(self.field(cords).front, (channels[selected], lx, ly), amounts[selected])
+
+    def sample(self, points, channels) -> np.ndarray:
+        """
+            Pheromones at global tiles.
+
+        :param channels: Channel index per point or for all points
+        :return: Array of shape (n,)
+        """
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        channels = np.broadcast_to(np.asarray(channels, dtype=np.int64), len(points))
+        output = np.zeros(len(points), dtype=np.float32)
+        for cords, selected, lx, ly in by_room(points, self.dimensions):
+            layers = self.fields[cords].front if cords in self.fields else self.ghosts.get(cords)
+            if layers is not None:
+                output[selected] = layers[channels[selected], lx, ly]
+        return output
+
+    def fed(self, cords) -> bool:
+        """
+            Whether pheromones above threshold flow into a room, its field would be woken right after being dropped.
+        """
+        for (dx, dy), edge in EDGES.items():
+            source = (cords[0] - dx, cords[1] - dy)
+            layers = self.fields[source].front if source in self.fields else self.ghosts.get(source)
+            if layers is not None and layers[(slice(None), *edge)].max(initial=0) > self.threshold:
+                return True
+        return False
+
+    def step(self, tick, simulated) -> list:
+        """
+            Diffuse and evaporate pheromones of simulated rooms by one tick.
+
+        :param simulated: Cords of rooms simulated here
+        :return: Cords of rooms whose pheromones changed, including the ones whose field was dropped
+        """
+        self.tick = tick
+        stepped = [(cords, field) for cords, field in self.fields.items() if cords in simulated]
+        # Pheromones only flow between fields that existed at the start of the tick, the ones ghosts were made from.
+        # Fields woken below take part from the next tick on, once their neighbours know about them as well.
+        layers = {cords: field.front for cords, field in stepped} | self.ghosts
+        for cords, front in list(layers.items()):
+            for (dx, dy), edge in EDGES.items():
+                target = (cords[0] + dx, cords[1] + dy)
+                if target in simulated and target not in self.fields and front[(slice(None), *edge)].max(
+                        initial=0) > self.threshold:
+                    self.field(target)
+
+        width, height = self.dimensions
+        for cords, field in stepped:
+            self.catch_up(field, tick)
+            front = field.front
+            padded = np.empty((front.shape[0], width + 2, height + 2), dtype=np.float32)
+            padded[:, 1:-1, 1:-1] = front
+            for (dx, dy), edge in EDGES.items():
+                halo = (slice(None), *((slice(-1, None) if d > 0 else slice(0, 1)) if d else slice(1, -1)
+                                       for d in (dx, dy)))
+                neighbour = layers.get((cords[0] + dx, cords[1] + dy))
+                # Borders with rooms without pheromones mirror the room's own edge, nothing flows through them.
+                padded[halo] = front[(slice(None), *edge)] if neighbour is None else \
+                    neighbour[(slice(None), *EDGES[(-dx, -dy)])]
+            laplacian = (padded[:, :-2, 1:-1] + padded[:, 2:, 1:-1] + padded[:, 1:-1, :-2] + padded[:, 1:-1, 2:] -
+                         4 * front)
+            np.multiply(front + self.diffusion * laplacian, 1 - self.evaporation, out=field.back)
+            field.tick = tick
+        [field.swap() for _, field in stepped]
+        for cords, field in stepped:
+            if field.front.max() < self.threshold and not self.fed(cords):
+                del self.fields[cords]
+        return [cords for cords, _ in stepped]
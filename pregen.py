@@ -0,0 +1,102 @@
+import argparse
+import os
+import pickle as pkl
+import time
+from pathlib import Path
+
+import worldgen
+from misc import ProjSettings
+from misc.Paths import cwd
+from storage import RegionStore
+from world import Room, saved_settings
+
+
+def pregenerate(sim_name, world_settings, rect=None, batch=256, report=2.):
+    """
+        Generate a rectangle of rooms (whole world by default) with WorldGenHandler and write them to world's save.
+        Rooms that are already saved are skipped, so an interrupted run can be resumed.
+
+    :param sim_name: Simulation's name, save goes to cwd/sim_name/world_settings.name
+    :param world_settings: World's settings
+    :param rect: Rooms to generate (x0, y0, x1, y1)
+    :param batch: Amount of rooms written at once
+    :param report: Seconds between progress reports
+    :return: Amount of generated rooms
+    """
+    x0, y0, x1, y1 = rect or (0, 0, *world_settings.dimensions)
+    path = Path(cwd, sim_name, world_settings.name)
+    store = RegionStore(Path(path, 'regions'), world_settings.save_region_size)
+    path.mkdir(parents=True, exist_ok=True)
+    if not Path(path, 'world.pk').exists():
+        with open(Path(path, 'world.tmp'), 'wb+') as savefile:
+            pkl.dump({'tick': 0, 'settings': world_settings, 'world': saved_settings(world_settings), 'events': []},
+                     savefile)
+        os.replace(Path(path, 'world.tmp'), Path(path, 'world.pk'))
+
+    stored = store.stored()
+    step = world_settings.region_block
+    blocks = [(bx, by, min(bx + step, x1), min(by + step, y1))
+              for bx in range(x0, x1, step) for by in range(y0, y1, step)]
+    # Blocks without saved rooms are generated in one pass, only missing rooms of partly saved blocks are requested.
+    regions, rooms = [], []
+    for bx0, by0, bx1, by1 in blocks:
+        missing = [(x, y) for x in range(bx0, bx1) for y in range(by0, by1) if (x, y) not in stored]
+        if len(missing) == (bx1 - bx0) * (by1 - by0):
+            regions.append((bx0, by0, bx1, by1))
+        else:
+            rooms += missing
+    total = sum((bx1 - bx0) * (by1 - by0) for bx0, by0, bx1, by1 in regions) + len(rooms)
+    print(f'{world_settings.name}: {(x1 - x0) * (y1 - y0) - total} rooms already saved, {total} to generate')
+    if not total:
+        return 0
+
+    generator = worldgen.WorldGenHandler(world_settings)
+    generator.start()
+    [generator.request_region(*region) for region in regions]
+    [generator.request(*cords) for cords in rooms]
+    start = last_report = time.perf_counter()
+    done, pending = 0, {}
+    try:
+        while done < total:
+            cords, slot = generator.output.get()
+            done += 1
+            if slot is None or slot < 0:
+                continue
+            if cords in stored:
+                generator.slab.release(slot)
+                continue
+            room = Room(cords)
+            room.layout = generator.slab.take(slot)
+            room.generate()
+            pending[cords] = room.dump()
+            if len(pending) >= batch:
+                store.save(pending)
+                pending.clear()
+            now = time.perf_counter()
+            if now - last_report >= report:
+                last_report = now
+                speed = done / (now - start)
+                print(f'{done}/{total} rooms ({done / total:.1%}), {speed:.0f} rooms/s, '
+                      f'{(total - done) / speed:.0f}s left')
+    finally:
+        store.save(pending)
+        generator.halt()
+        generator.join()
+        generator.slab.close()
+    elapsed = time.perf_counter() - start
+    print(f'{done} rooms in {elapsed:.1f}s, {done / max(elapsed, 1e-9):.0f} rooms/s')
+    return done
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pre-generate a world into its save without rendering.')
+    parser.add_argument('name', help="world's name")
+    parser.add_argument('seed', help="world's seed")
+    parser.add_argument('--sim', default='pregenerated', help="simulation's name (save directory)")
+    parser.add_argument('--rect', type=int, nargs=4, metavar=('X0', 'Y0', 'X1', 'Y1'),
+                        help='rooms to generate, whole world by default')
+    args = parser.parse_args()
+
+    settings = ProjSettings.WorldSettings()
+    settings.name, settings.seed = args.name, args.seed
+    pregenerate(args.sim, settings, args.rect)
@@ -0,0 +1,351 @@
+import multiprocessing as mp
+
+import numpy as np
+
+from lifeforms import AntPopulation
+from misc import ProjSettings
+from pheromones import EDGES, Pheromones
+from world import Room, World
+
+# Directions to the 8 neighbouring rooms.
+DIRECTIONS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+
+
+def shard_of(cords, shards, block) -> int:
+    """
+        Shard that simulates a room. Rooms are assigned in blocks of block x block rooms, so most neighbours of a
+        room are in the same shard and only blocks' edges have to be exchanged.
+    """
+    return hash((cords[0] // block, cords[1] // block)) % shards
+
+
+def border(dimensions, direction, width) -> tuple[slice, slice]:
+    """
+        Slices of room's tiles within width tiles of its edge facing direction.
+    """
+    return tuple(slice(None) if d == 0 else slice(size - width, size) if d > 0 else slice(0, width)
+                 for d, size in zip(direction, dimensions))
+
+
+class Shard:
+    """
+        Part of the world simulated by a single LogicProcess: its own rooms and ghosts of neighbouring rooms owned
+        by other shards. Ghosts only hold tiles and layout within ghost_width of the shard's edge and are refreshed
+        at every tick boundary, tiles further into them read as empty tiles; pheromones of their edges are exchanged
+        the same way, so pheromones flow between shards.
+        Passed to rooms' and tiles' updates instead of World, shares World's tile queries.
+    """
+
+    def __init__(self, index, ghost_width=1, seed=0, sim_settings=None):
+        self.index = index
+        self.ghost_width = ghost_width
+        self.sim_settings = sim_settings or ProjSettings.SimSettings()
+        self.tick = 0
+        self.ants = AntPopulation(self.sim_settings.room_settings.dimensions, seed=(seed, index),
+                                  cell_size=self.sim_settings.spatial_cell)
+        self.pheromones = Pheromones(self.sim_settings.room_settings.dimensions,
+                                     self.sim_settings.pheromone_diffusion, self.sim_settings.pheromone_evaporation,
+                                     self.sim_settings.pheromone_threshold)
+        self.rooms: dict[tuple[int, int], Room] = {}
+        self.ghosts: dict[tuple[int, int], Room] = {}
+        self.owners: dict[tuple[int, int], int] = {}
+        self.changed = set()
+        self.outgoing = []
+        self.events = []
+
+    locate = World.locate
+    tile_at = World.tile_at
+    region = World.region
+    neighbourhood = World.neighbourhood
+
+    def get_room(self, cords):
+        """
+            Own room or a ghost of a neighbouring room, None for rooms that aren't simulated.
+        """
+        return self.rooms.get(cords) or self.ghosts.get(cords)
+
+    def add_room(self, room, ants, pheromones=None) -> None:
+        """
+            Take over a room, its ants' fields (see AntPopulation.rows()) and its pheromones (see Pheromones.take()).
+        """
+        room.changes = self.changed
+        self.ants.put(ants)
+        self.pheromones.put(room.cords, pheromones)
+        room.ants = {key: self.ants.ant(key) for key in ants['key'].tolist()}
+        self.rooms[room.cords] = room
+        self.ghosts.pop(room.cords, None)
+
+    def release(self, cords):
+        """
+            Give a room back, see add_room().
+
+        :return: Room's arrays, its ants' fields and its pheromones
+        """
+        room = self.rooms.pop(cords)
+        self.changed.discard(cords)
+        ants = self.ants.rows(list(room.ants))
+        self.ants.remove(list(room.ants))
+        return room.dump(), ants, self.pheromones.take(cords)
+
+    def migrate(self, source, key, target) -> bool:
+        """
+            Move an ant to another room, see World.migrate(). Ants moving to other shards are sent at the tick
+            boundary.
+        """
+        owner = self.owners.get(target)
+        if owner is None:
+            return False
+        ant = self.rooms[source].ants.pop(key)
+        self.rooms[source].mark_dirty()
+        if owner == self.index:
+            self.rooms[target].ants[key] = ant
+            self.rooms[target].mark_dirty()
+        else:
+            # Ant's fields stay in the population until the tick boundary, AntPopulation.step() is still running.
+            self.outgoing.append((owner, target, key))
+        return True
+
+    def update(self, tick) -> None:
+        self.tick = tick
+        for cords in sorted(self.rooms):
+            room = self.rooms[cords]
+            room.catch_up(tick, self, self.events)
+            room.update(tick, self, self.events)
+        # Pheromones step before ants deposit, so they diffuse from the same values that were sent as ghosts.
+        self.pheromones.step(tick, self.rooms.keys())
+        self.ants.step(self, tick, self.rooms.keys())
+
+    def messages(self, shards) -> list[dict]:
+        """
+            Ghost borders of own rooms, their pheromones and migrating ants for every shard.
+        """
+        messages = [{'ghosts': [], 'pheromones': [], 'targets': [], 'ants': None} for _ in range(shards)]
+        for cords, room in self.rooms.items():
+            for direction in DIRECTIONS:
+                owner = self.owners.get((cords[0] + direction[0], cords[1] + direction[1]))
+                if owner is None or owner == self.index:
+                    continue
+                area = border(room.settings.dimensions, direction, self.ghost_width)
+                messages[owner]['ghosts'].append((cords, area, room.field('layout')[area].copy(),
+                                                  room.tiles.types[area].copy(), room.tiles.occupied[area].copy()))
+        for cords, field in self.pheromones.fields.items():
+            for direction, edge in EDGES.items():
+                owner = self.owners.get((cords[0] + direction[0], cords[1] + direction[1]))
+                if owner is not None and owner != self.index:
+                    messages[owner]['pheromones'].append((cords, edge, field.front[(slice(None), *edge)].copy()))
+        for owner, target, key in self.outgoing:
+            # Ants that died after crossing the border don't move.
+            if key in self.ants.index:
+                messages[owner]['targets'].append((target, key))
+        for message in messages:
+            keys = [key for _, key in message['targets']]
+            message['ants'] = self.ants.rows(keys)
+            self.ants.remove(keys)
+        self.outgoing.clear()
+        return messages
+
+    def receive(self, message) -> None:
+        for cords, area, layout, types, occupied in message['ghosts']:
+            ghost = self.ghosts.get(cords)
+            if ghost is None:
+                ghost = self.ghosts[cords] = Room(cords)
+            ghost.field('layout')[area] = layout
+            # Bumps ghost's version as well, caches built from it see the new layout too.
+            ghost.tiles.load_area(area, types, occupied)
+        for cords, edge, pheromones in message.get('pheromones', ()):
+            self.pheromones.ghost(cords)[(slice(None), *edge)] = pheromones
+        self.ants.put(message['ants'])
+        for target, key in message['targets']:
+            self.rooms[target].ants[key] = self.ants.ant(key)
+            self.rooms[target].mark_dirty()
+
+    def sync(self) -> dict:
+        """
+            Arrays of rooms changed since the last sync (None for unchanged rooms) and fields of their ants, for
+            changed rooms and rooms with ants.
+        """
+        synced = {cords: (room.dump() if cords in self.changed else None, self.ants.rows(list(room.ants)))
+                  for cords, room in self.rooms.items() if cords in self.changed or room.ants}
+        self.changed.clear()
+        return synced
+
+
+class LogicProcess(mp.Process):
+    """
+        Simulates one shard of the world, driven by ShardedSimulation through a pipe. Every tick:
+        release and receive rooms, update own rooms, send ghost borders and migrating ants to the other shards,
+        wait for all shards at the barrier, apply what they sent and report changed rooms and events back.
+    """
+
+    def __init__(self, index, connection, inboxes, barrier, ghost_width=1, seed=0, sim_settings=None):
+        super().__init__(daemon=True, name=f'Antsy Shard {index}')
+        self.index = index
+        self.connection = connection
+        self.inboxes = inboxes
+        self.barrier = barrier
+        self.ghost_width = ghost_width
+        self.seed = seed
+        self.sim_settings = sim_settings
+
+    def run(self) -> None:
+        shard = Shard(self.index, self.ghost_width, self.seed, self.sim_settings)
+        while True:
+            command = self.connection.recv()
+            if command is None:
+                break
+            tick, assigned, released, rooms, spawned = command
+            shard.pheromones.tick = tick - 1
+            returned = {}
+            for cords in released:
+                shard.owners.pop(cords, None)
+                shard.ghosts.pop(cords, None)
+                shard.pheromones.ghosts.pop(cords, None)
+                if cords in shard.rooms:
+                    returned[cords] = shard.release(cords)
+            shard.owners |= assigned
+            for cords, (arrays, ants, pheromones) in rooms.items():
+                shard.add_room(Room.restore(cords, arrays), ants, pheromones)
+            shard.receive(spawned)
+            for cords in [cords for cords in shard.ghosts if cords not in shard.owners]:
+                del shard.ghosts[cords]
+
+            shard.update(tick)
+
+            for owner, message in enumerate(shard.messages(len(self.inboxes))):
+                if owner != self.index:
+                    self.inboxes[owner].put(message)
+            self.barrier.wait()
+            shard.pheromones.ghosts.clear()
+            for _ in range(len(self.inboxes) - 1):
+                shard.receive(self.inboxes[self.index].get())
+            self.connection.send((returned, shard.sync(), shard.events))
+            shard.events = []
+
+
+class ShardedSimulation:
+    """
+        Splits simulated rooms between LogicProcess workers, so rooms are updated on all cores. Rooms are sent to
+        their shard when they become active and come back when they stop being active; in between, World's rooms
+        are mirrors refreshed from rooms the shards changed, changing them has no effect on the simulation.
+        Shards tick in lock-step, every World.update() waits for all of them.
+        Workers simulate with World's sim_settings, so settings changed on World's instance apply to the shards too.
+    """
+
+    def __init__(self, processes, block=4, ghost_width=1, seed=0, sim_settings=None):
+        self.block = block
+        self.owned: dict[tuple[int, int], tuple[int, Room]] = {}
+        self.spawned = []
+        self.connections = []
+        self.workers = []
+        inboxes = [mp.Queue() for _ in range(processes)]
+        barrier = mp.Barrier(processes)
+        for index in range(processes):
+            connection, worker_connection = mp.Pipe()
+            self.connections.append(connection)
+            self.workers.append(LogicProcess(index, worker_connection, inboxes, barrier, ghost_width, seed,
+                                             sim_settings))
+        [worker.start() for worker in self.workers]
+
+    def update(self, world) -> None:
+        """
+            Tick world's active rooms in the shards and apply their changes to world's rooms.
+        """
+        released = {cords: room for cords, (_, room) in self.owned.items()
+                    if cords not in world.active or world.rooms.get(cords) is not room}
+        for cords in released:
+            del self.owned[cords]
+        assigned = {}
+        rooms = [{} for _ in self.workers]
+        world.pheromones.tick = world.tick - 1
+        for cords in sorted(world.active - self.owned.keys()):
+            room = world.rooms[cords]
+            owner = assigned[cords] = shard_of(cords, len(self.workers), self.block)
+            rooms[owner][cords] = (room.dump(), world.ants.rows(list(room.ants)), world.pheromones.take(cords))
+            self.owned[cords] = (owner, room)
+        # Ants spawned into rooms the shards already simulate.
+        ants = [{'ghosts': [], 'targets': [], 'ants': None} for _ in self.workers]
+        spawned = [key for key in self.spawned if key in world.ants.index]
+        for key, cords in zip(spawned, map(tuple, world.ants.rooms()[[world.ants.index[key] for key in spawned]]
+                                           .reshape(-1, 2).tolist())):
+            if cords in self.owned and cords not in assigned:
+                ants[self.owned[cords][0]]['targets'].append((cords, key))
+        self.spawned.clear()
+        for message in ants:
+            message['ants'] = world.ants.rows([key for _, key in message['targets']])
+        for connection, shard_rooms, shard_ants in zip(self.connections, rooms, ants):
+            connection.send((world.tick, assigned, list(released), shard_rooms, shard_ants))
+        states = []
+        for connection, worker in zip(self.connections, self.workers):
+            while not connection.poll(1):
+                if not worker.is_alive():
+                    raise RuntimeError(f'{worker.name} stopped')
+            returned, synced, events = connection.recv()
+            states += [(released[cords], state[:2]) for cords, state in returned.items()]
+            world.pheromones.tick = world.tick
+            [world.pheromones.put(cords, state[2]) for cords, state in returned.items()
+             if world.rooms.get(cords) is released[cords]]
+            states += [(self.owned[cords][1], state) for cords, state in synced.items()]
+            world.events.extend(events)
+        # Room was replaced (world was loaded) while it was simulated.
+        states = [(room, state) for room, state in states if world.rooms.get(room.cords) is room]
+        # Ants that aren't in any reported room anymore died.
+        gone = set().union(*(room.ants for room, _ in states))
+        gone -= set().union(*(state[1]['key'].tolist() for _, state in states))
+        world.ants.remove(list(gone))
+        for room, (arrays, ants) in states:
+            world.ants.put(ants)
+            room.ants = {key: world.ants.ant(key) for key in ants['key'].tolist()}
+            if arrays is not None:
+                room.load(arrays)
+                room.mark_dirty()
+
+    def spawned_ants(self, keys) -> None:
+        """
+            Send ants spawned into simulated rooms to their shards with the next tick.
+        """
+        self.spawned.extend(keys)
+
+    def halt(self, world) -> None:
+        """
+            Bring all rooms back to the world and stop the workers.
+        """
+        world.active = set()
+        self.update(world)
+        for connection in self.connections:
+            connection.send(None)
+        [worker.join() for worker in self.workers]
+
+
+def check_pheromones(shards=2, rooms=4, ticks=200) -> tuple[float, float]:
+    """
+        Step pheromones of a square of rooms split between Shards in this process, exchanging messages the way
+        LogicProcess does, without evaporation or threshold; the amount of pheromones has to stay the same.
+
+    :param rooms: Side of the square of rooms
+    :return: Total amount of pheromones before and after
+    """
+    sim_settings = ProjSettings.SimSettings()
+    sim_settings.pheromone_evaporation = sim_settings.pheromone_threshold = 0.
+    workers = [Shard(index, sim_settings=sim_settings) for index in range(shards)]
+    owners = {(x, y): shard_of((x, y), shards, 1) for x in range(rooms) for y in range(rooms)}
+    for cords, owner in owners.items():
+        room = Room(cords)
+        room.generate()
+        workers[owner].add_room(room, workers[owner].ants.rows([]))
+    for shard in workers:
+        shard.owners = dict(owners)
+    width, height = sim_settings.room_settings.dimensions
+    workers[owners[(0, 0)]].pheromones.deposit(np.array([[width - 1, height // 2]]), 0, 100.)
+    total = lambda: sum(float(field.front.sum()) for shard in workers for field in shard.pheromones.fields.values())
+    before = total()
+    for tick in range(ticks):
+        [shard.update(tick) for shard in workers]
+        messages = [shard.messages(shards) for shard in workers]
+        for owner, shard in enumerate(workers):
+            shard.pheromones.ghosts.clear()
+            [shard.receive(sent[owner]) for sender, sent in enumerate(messages) if sender != owner]
+    return before, total()
+
+
+if __name__ == '__main__':
+    print('pheromones before and after: %.4f, %.4f' % check_pheromones())
@@ -0,0 +1,148 @@
+import numpy as np
+
+
+def _cell_codes(cx, cy) -> np.ndarray:
+    return cx.astype(np.int64) * 2 ** 32 + cy.astype(np.int64)
+
+
+class SpatialHash:
+    """
+        Uniform grid over global tile coordinates, cells are cell_size x cell_size tiles and ignore room borders.
+        Entities are kept as arrays (key, x, y, group) sorted by cell, so a query only looks at the cells around
+        it. Entities can be registered one by one (insert(), move(), remove()) or replaced all at once by sync(),
+        which is what AntPopulation does after every step; the order is rebuilt lazily before the next query.
+        All queries take many points at once.
+    """
+
+    def __init__(self, cell_size=8):
+        self.cell_size = cell_size
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.x = np.zeros(0, dtype=np.float32)
+        self.y = np.zeros(0, dtype=np.float32)
+        self.group = np.zeros(0, dtype=np.int32)
+        self.rows = None
+        self.order = None
+        self.codes = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def sync(self, keys, x, y, group=0) -> None:
+        """
+            Replace all entities.
+        """
+        self.keys = np.array(keys, dtype=np.int64)
+        self.x, self.y = np.array(x, dtype=np.float32), np.array(y, dtype=np.float32)
+        self.group = np.broadcast_to(np.asarray(group, dtype=np.int32), self.keys.shape).copy()
+        self.rows = self.order = None
+
+    def index(self) -> dict:
+        if self.rows is None:
+            self.rows = dict(zip(self.keys.tolist(), range(len(self.keys))))
+        return self.rows
+
+    def insert(self, keys, x, y, group=0) -> None:
+        keys = np.atleast_1d(np.asarray(keys, dtype=np.int64))
+        self.sync(np.concatenate([self.keys, keys]), np.concatenate([self.x, np.broadcast_to(x, keys.shape)]),
+                  np.concatenate([self.y, np.broadcast_to(y, keys.shape)]),
+                  np.concatenate([self.group, np.broadcast_to(np.asarray(group, dtype=np.int32), keys.shape)]))
+
+    def move(self, keys, x, y) -> None:
+        rows = [self.index()[key] for key in np.atleast_1d(keys).tolist()]
+        self.x[rows], self.y[rows] = x, y
+        self.order = None
+
+    def remove(self, keys) -> None:
+        keep = np.ones(len(self.keys), dtype=bool)
+        keep[[self.index()[key] for key in np.atleast_1d(keys).tolist() if key in self.index()]] = False
+        self.sync(self.keys[keep], self.x[keep], self.y[keep], self.group[keep])
+
+    def build(self) -> None:
+        if self.order is not None:
+            return
+        codes = _cell_codes(np.floor(self.x / self.cell_size), np.floor(self.y / self.cell_size))
+        self.order = np.argsort(codes, kind='stable')
+        self.codes = codes[self.order]
+
+    def candidates(self, points, reach) -> tuple[np.ndarray, np.ndarray]:
+        """
+            Rows of entities in cells within reach cells of every point.
+
+        :return: Point's index and entity's row of every candidate
+        """
+        self.build()
+        if (2 * reach + 1) ** 2 >= len(self.keys):
+            # Searching more cells than there are entities, every entity is a candidate.
+            return np.repeat(np.arange(len(points)), len(self.keys)), np.tile(np.arange(len(self.keys)), len(points))
+        cx = np.floor(points[:, 0] / self.cell_size).astype(np.int64)
+        cy = np.floor(points[:, 1] / self.cell_size).astype(np.int64)
+        found_points, found_rows = [], []
+        for dx in range(-reach, reach + 1):
+            for dy in range(-reach, reach + 1):
+                codes = _cell_codes(cx + dx, cy + dy)
+                starts = np.searchsorted(self.codes, codes, 'left')
+                counts = np.searchsorted(self.codes, codes, 'right') - starts
+                total = int(counts.sum())
+                if not total:
+                    continue
+                point = np.repeat(np.arange(len(points)), counts)
+                offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                found_points.append(point)
+                found_rows.append(self.order[np.repeat(starts, counts) + offsets])
+        if not found_points:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        return np.concatenate(found_points), np.concatenate(found_rows)
+
+    def radius(self, points, radius, group=None, exclude=None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+            Entities within radius of every point, sorted by point and distance.
+
+        :param points: Array of global (x, y) coordinates, shape (n, 2)
+        :param group: Only entities of this group
+        :param exclude: Key per point that's left out of its results (entity's own key), shape (n,)
+        :return: Point's index, entity's key and distance of every hit
+        """
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        point, rows = self.candidates(points, int(np.ceil(radius / self.cell_size)))
+        distance = np.hypot(self.x[rows] - points[point, 0], self.y[rows] - points[point, 1])
+        hit = distance <= radius
+        if group is not None:
+            hit &= self.group[rows] == group
+        if exclude is not None:
+            hit &= self.keys[rows] != np.asarray(exclude)[point]
+        point, rows, distance = point[hit], rows[hit], distance[hit]
+        order = np.lexsort((distance, point))
+        return point[order], self.keys[rows[order]], distance[order]
+
+    def nearest(self, points, k, max_radius=None, group=None, exclude=None) -> tuple[np.ndarray, np.ndarray]:
+        """
+            k nearest entities of every point, found by searching growing radii.
+
+        :param max_radius: Don't look further, points may get less than k entities then
+        :return: Keys and distances, shape (n, k); missing entities have key -1 and distance inf
+        """
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        keys = np.full((len(points), k), -1, dtype=np.int64)
+        distances = np.full((len(points), k), np.inf, dtype=np.float32)
+        pending = np.arange(len(points))
+        limit = max_radius if max_radius is not None else np.inf
+        if len(self.keys):
+            # Start with the radius expected to hold k entities if they were spread evenly.
+            area = max(float(np.ptp(self.x)) * float(np.ptp(self.y)), 1.)
+            radius = max(np.sqrt(k * area / (np.pi * len(self.keys))), 1.)
+            farthest = np.hypot(np.maximum(np.abs(points[:, 0] - self.x.min()), np.abs(points[:, 0] - self.x.max())),
+                                np.maximum(np.abs(points[:, 1] - self.y.min()), np.abs(points[:, 1] - self.y.max())))
+        while len(pending) and len(self.keys):
+            radius = min(radius, limit)
+            point, found, distance = self.radius(points[pending], radius, group,
+                                                 None if exclude is None else np.asarray(exclude)[pending])
+            counts = np.bincount(point, minlength=len(pending))
+            rank = np.arange(len(point)) - np.repeat(np.cumsum(counts) - counts, counts)
+            # Points whose search already covers every entity can't find more.
+            done = (counts >= k) | (radius >= limit) | (radius >= farthest[pending])
+            take = done[point] & (rank < k)
+            keys[pending[point[take]], rank[take]] = found[take]
+            distances[pending[point[take]], rank[take]] = distance[take]
+            pending = pending[~done]
+            radius *= 2
+        return keys, distances
@@ -0,0 +1,311 @@
+import hashlib
+import mmap
+import os
+import sqlite3
+import struct
+import time
+from pathlib import Path
+
+import numpy as np
+
+from misc.Paths import cwd
+
+
+def seed_key(seed) -> str:
+    """
+        Short stable key of a world's seed, used to tell worlds apart in shared files.
+    """
+    return hashlib.sha256(str(seed).encode('utf-8')).hexdigest()[:16]
+
+
+class RoomCache:
+    """
+        Persistent cache of generated rooms, sqlite file shared by all workers of all worlds.
+        Rooms are keyed by world's seed, generator version and room's coordinates and stored as packed bits.
+        Rooms of other generator versions are dropped on open, the least recently used rooms are evicted when
+        the file grows over max_bytes.
+        Every worker (thread or process) should use its own instance.
+    """
+
+    def __init__(self, seed, version, dimensions, max_bytes, path=None):
+        self.seed = seed_key(seed)
+        self.dimensions = tuple(dimensions)
+        self.version = f'{version}-{self.dimensions[0]}x{self.dimensions[1]}'
+        self.max_bytes = max_bytes
+        self.path = Path(path or Path(cwd, 'cache', 'rooms.sqlite'))
+        self.connection = None
+        self.writes = 0
+
+    def connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.connection = sqlite3.connect(self.path, timeout=30)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS rooms (seed TEXT, version TEXT, x INTEGER, '
+                                    'y INTEGER, data BLOB, accessed REAL, PRIMARY KEY (seed, version, x, y))')
+            self.connection.execute('DELETE FROM rooms WHERE version != ?', (self.version,))
+            self.connection.commit()
+        return self.connection
+
+    def unpack(self, data):
+        return np.unpackbits(np.frombuffer(data, dtype=np.uint8),
+                             count=self.dimensions[0] * self.dimensions[1]).reshape(self.dimensions)
+
+    def get(self, cords):
+        """
+            Get a cached room.
+
+        :param cords: Room's coordinates
+        :return: Room's uint8 array or None if it wasn't cached
+        """
+        row = self.connect().execute('SELECT data FROM rooms WHERE seed = ? AND version = ? AND x = ? AND y = ?',
+                                     (self.seed, self.version, *cords)).fetchone()
+        if row is None:
+            return None
+        self.touch([cords])
+        return self.unpack(row[0])
+
+    def get_region(self, x0, y0, x1, y1) -> dict:
+        """
+            Get all cached rooms of a rectangle.
+
+        :return: Dict of room's coordinates to uint8 array, rooms that weren't cached are missing
+        """
+        rows = self.connect().execute('SELECT x, y, data FROM rooms WHERE seed = ? AND version = ? '
+                                      'AND x >= ? AND x < ? AND y >= ? AND y < ?',
+                                      (self.seed, self.version, x0, x1, y0, y1)).fetchall()
+        self.touch([(x, y) for x, y, _ in rows])
+        return {(x, y): self.unpack(data) for x, y, data in rows}
+
+    def touch(self, cords):
+        if not cords:
+            return
+        now = time.time()
+        self.connect().executemany('UPDATE rooms SET accessed = ? WHERE seed = ? AND version = ? AND x = ? AND y = ?',
+                                   [(now, self.seed, self.version, *c) for c in cords])
+
+    def put(self, cords, grid):
+        """
+            Store a generated room, call commit() to make it visible to other workers.
+        """
+        self.connect().execute('INSERT OR REPLACE INTO rooms VALUES (?, ?, ?, ?, ?, ?)',
+                               (self.seed, self.version, *cords, np.packbits(grid).tobytes(), time.time()))
+        self.writes += 1
+
+    def commit(self):
+        if self.connection is None:
+            return
+        self.connection.commit()
+        if self.writes >= 1000:
+            self.writes = 0
+            self.evict()
+
+    def evict(self):
+        """
+            Remove the least recently used rooms until the stored rooms fit into max_bytes.
+        """
+        connection = self.connect()
+        size = connection.execute('SELECT COALESCE(SUM(LENGTH(data)), 0) + COUNT(*) * 64 FROM rooms').fetchone()[0]
+        if size <= self.max_bytes:
+            return
+        row_size = 64 + (self.dimensions[0] * self.dimensions[1] + 7) // 8
+        excess = (size - self.max_bytes) // row_size + 1
+        connection.execute('DELETE FROM rooms WHERE rowid IN (SELECT rowid FROM rooms ORDER BY accessed LIMIT ?)',
+                           (excess,))
+        connection.commit()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.commit()
+            self.connection.close()
+            self.connection = None
+
+
+def pack_arrays(arrays: dict) -> bytes:
+    """
+        Serialize a dict of named numpy arrays into a compact blob.
+
+        Layout: u8 amount, then for every array: u8 name length, name, u8 dtype length, dtype, u8 ndim,
+        u32 dimensions, raw C-ordered data.
+    """
+    parts = [struct.pack('<B', len(arrays))]
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        name, dtype = name.encode('utf-8'), array.dtype.str.encode('ascii')
+        parts.append(struct.pack(f'<B{len(name)}sB{len(dtype)}sB{array.ndim}I', len(name), name, len(dtype), dtype,
+                                 array.ndim, *array.shape))
+        parts.append(array.tobytes())
+    return b''.join(parts)
+
+
+def unpack_arrays(data) -> dict:
+    """
+        Read arrays written by pack_arrays(), arrays are copied out of data.
+    """
+    arrays = {}
+    (amount,), offset = struct.unpack_from('<B', data), 1
+    for _ in range(amount):
+        (length,), offset = struct.unpack_from('<B', data, offset), offset + 1
+        name = bytes(data[offset:offset + length]).decode('utf-8')
+        offset += length
+        (length,), offset = struct.unpack_from('<B', data, offset), offset + 1
+        dtype = np.dtype(bytes(data[offset:offset + length]).decode('ascii'))
+        offset += length
+        (ndim,), offset = struct.unpack_from('<B', data, offset), offset + 1
+        shape = struct.unpack_from(f'<{ndim}I', data, offset)
+        offset += 4 * ndim
+        size = int(np.prod(shape)) * dtype.itemsize
+        arrays[name] = np.frombuffer(data, dtype=dtype, count=int(np.prod(shape)), offset=offset).reshape(shape).copy()
+        offset += size
+    return arrays
+
+
+class RegionFile:
+    """
+        Single region file, holds up to size x size rooms.
+
+        Layout: header (magic, format version, region size), index of size * size (offset, length) entries, then
+        room blobs (see pack_arrays()). Rewritten rooms are appended and their index entry is updated in place,
+        so saving a few rooms only writes those rooms; the file is compacted when most of it is stale.
+    """
+    magic = b'AWRG'
+    version = 1
+    header = struct.Struct('<4sHH')
+    entry = struct.Struct('<QI')
+
+    def __init__(self, path, size):
+        self.path = Path(path)
+        self.size = size
+        self.data_start = self.header.size + self.entry.size * size * size
+
+    def index(self, data) -> list[tuple[int, int]]:
+        magic, version, size = self.header.unpack_from(data)
+        if magic != self.magic or version != self.version or size != self.size:
+            raise ValueError(f'{self.path} is not a region file of size {self.size}')
+        return [self.entry.unpack_from(data, self.header.size + i * self.entry.size) for i in range(size * size)]
+
+    def read(self, slots=None) -> dict:
+        """
+            Read rooms from the file, only the requested blobs are touched.
+
+        :param slots: Local room indices (x * size + y) to read, all stored rooms if None
+        :return: Dict of local index to arrays dict
+        """
+        if not self.path.exists():
+            return {}
+        with open(self.path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            index = self.index(data)
+            slots = range(len(index)) if slots is None else slots
+            return {slot: unpack_arrays(memoryview(data)[index[slot][0]:index[slot][0] + index[slot][1]])
+                    for slot in slots if index[slot][1]}
+
+    def stored(self) -> list[int]:
+        """
+            Local indices of all stored rooms.
+        """
+        if not self.path.exists():
+            return []
+        with open(self.path, 'rb') as file:
+            return [slot for slot, (_, length) in enumerate(self.index(file.read(self.data_start))) if length]
+
+    def write(self, rooms: dict) -> int:
+        """
+            Store rooms in the file.
+
+        :param rooms: Dict of local index to arrays dict
+        :return: Amount of bytes written
+        """
+        if not self.path.exists():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'wb') as file:
+                file.write(self.header.pack(self.magic, self.version, self.size))
+                file.write(bytes(self.entry.size * self.size * self.size))
+        written = 0
+        with open(self.path, 'r+b') as file:
+            index = self.index(file.read(self.data_start))
+            end = file.seek(0, 2)
+            for slot, arrays in rooms.items():
+                blob = pack_arrays(arrays)
+                file.write(blob)
+                index[slot] = (end, len(blob))
+                end += len(blob)
+                written += len(blob)
+            for slot in rooms:
+                file.seek(self.header.size + slot * self.entry.size)
+                file.write(self.entry.pack(*index[slot]))
+            written += self.entry.size * len(rooms)
+        if end > 2 * (self.data_start + sum(length for _, length in index)) + 2 ** 16:
+            self.compact()
+        return written
+
+    def compact(self):
+        """
+            Rewrite the file without stale blobs.
+        """
+        rooms = self.read()
+        temp = self.path.with_suffix('.tmp')
+        temp.unlink(missing_ok=True)
+        RegionFile(temp, self.size).write(rooms)
+        os.replace(temp, self.path)
+
+
+class RegionStore:
+    """
+        World's rooms split into region files of region_size x region_size rooms.
+    """
+
+    def __init__(self, path, region_size=16):
+        self.path = Path(path)
+        self.region_size = region_size
+
+    def locate(self, cords) -> tuple[tuple[int, int], int]:
+        """
+            Region's coordinates and room's local index inside of the region.
+        """
+        (rx, lx), (ry, ly) = divmod(cords[0], self.region_size), divmod(cords[1], self.region_size)
+        return (rx, ry), lx * self.region_size + ly
+
+    def region(self, region) -> RegionFile:
+        return RegionFile(Path(self.path, f'r.{region[0]}.{region[1]}.bin'), self.region_size)
+
+    def save(self, rooms: dict) -> int:
+        """
+            Store rooms, grouped by region.
+
+        :param rooms: Dict of room's coordinates to arrays dict
+        :return: Amount of bytes written
+        """
+        regions = {}
+        for cords, arrays in rooms.items():
+            region, slot = self.locate(cords)
+            regions.setdefault(region, {})[slot] = arrays
+        return sum(self.region(region).write(slots) for region, slots in regions.items())
+
+    def load(self, cords) -> dict:
+        """
+            Read rooms, every region file is mapped once.
+
+        :param cords: Rooms' coordinates
+        :return: Dict of room's coordinates to arrays dict, rooms that weren't saved are missing
+        """
+        regions = {}
+        for c in cords:
+            region, slot = self.locate(c)
+            regions.setdefault(region, {})[slot] = c
+        output = {}
+        for region, slots in regions.items():
+            output |= {slots[slot]: arrays for slot, arrays in self.region(region).read(list(slots)).items()}
+        return output
+
+    def stored(self) -> set:
+        """
+            Coordinates of all saved rooms.
+        """
+        output = set()
+        for file in self.path.glob('r.*.*.bin'):
+            rx, ry = map(int, file.name.split('.')[1:3])
+            for slot in self.region((rx, ry)).stored():
+                lx, ly = divmod(slot, self.region_size)
+                output.add((rx * self.region_size + lx, ry * self.region_size + ly))
+        return output
@@ -1,28 +1,74 @@
+import itertools
+from collections.abc import Mapping
+
+import numpy as np
+
 from misc import ProjSettings
 
 
 class Tile:
-    def __init__(self, cords):
-        self.occupied = False
-        self.settings = ProjSettings.EmptyTile()
+    """
+        Single tile. Tiles of a room are stored in the room's TileGrid, Tile objects made by the grid are views
+        over its arrays; tiles without a room keep their own state.
+    """
+    settings = ProjSettings.EmptyTile()
+
+    def __init__(self, cords, room=None):
         self.cords = cords
+        self.room = room
+        self._occupied = False
+
+    @property
+    def occupied(self) -> bool:
+        if self.room is None:
+            return self._occupied
+        return bool(self.room.tiles.occupied[self.cords])
+
+    @occupied.setter
+    def occupied(self, value):
+        if self.room is None:
+            self._occupied = value
+        else:
+            self.room.tiles.occupied[self.cords] = value
+
+    def changed(self):
+        if self.room is not None:
+            self.room.mark_dirty()
 
     def move_from(self):
         self.occupied = False
+        self.changed()
         return True
 
     def move_to(self):
         if not self.occupied:
             self.occupied = True
+            self.changed()
             return True
         return False
 
     def update(self, tick, world, events=None) -> None:
         if self.settings.interactable:
             self.interaction_logic(tick, world, events)
-        if self.settings.tickable:
+        if self.settings.tick_logic:
             self.tick_logic(tick, world, events)
 
+    def schedule(self, tick) -> None:
+        """
+            Run tile's tick_logic() at a future tick, even if tile's type doesn't tick every tick.
+        """
+        self.room.timers.add(tick, self.cords)
+
+    def catch_up(self, tick, elapsed, world, events=None) -> None:
+        """
+            Called once when a dormant room wakes up, instead of the update()s it missed.
+            Long running effects should use schedule(), timers are fired on wake up as well.
+
+        :param tick: Current tick
+        :param elapsed: Amount of missed ticks
+        """
+        self.update(tick, world, events)
+
     def interaction_logic(self, tick, world, events=None):
         pass
 
@@ -31,31 +77,147 @@ class Tile:
 
 
 class MaterialTile(Tile):
-    def __init__(self, cords):
-        super().__init__(cords)
+    settings = ProjSettings.MaterialTile()
+
+    def __init__(self, cords, room=None):
+        super().__init__(cords, room)
 
     def move_to(self):
         return False
 
 
 class RockTile(Tile):
-    def __init__(self, cords):
-        super().__init__(cords)
+    settings = ProjSettings.RockTile()
+
+    def __init__(self, cords, room=None):
+        super().__init__(cords, room)
 
     def move_to(self):
         return False
 
 
-class FoodTile(Tile):
-    def __init__(self, cords):
-        super().__init__(cords)
+class GoalTile(Tile):
+    """
+        Tile ants head to, ants share the way to it through a flow field.
+    """
+
+    def __init__(self, cords, room=None):
+        super().__init__(cords, room)
+
+    def flow_field(self, world):
+        """
+            World's flow field towards this tile, covering settings.flow_radius rooms around it.
+        """
+        width, height = self.room.settings.dimensions
+        goal = (self.room.cords[0] * width + self.cords[0], self.room.cords[1] * height + self.cords[1])
+        return world.flow_fields.toward([goal], self.settings.flow_radius)
+
+
+class FoodTile(GoalTile):
+    settings = ProjSettings.FoodTile()
+
+    def __init__(self, cords, room=None):
+        super().__init__(cords, room)
+
 
+class NestTile(GoalTile):
+    settings = ProjSettings.NestTile()
 
-class NestTile(Tile):
-    def __init__(self, cords):
-        super().__init__(cords)
+    def __init__(self, cords, room=None):
+        super().__init__(cords, room)
 
 
 class EmptyTile(Tile):
-    def __init__(self, cords):
-        super().__init__(cords)
\ No newline at end of file
+    def __init__(self, cords, room=None):
+        super().__init__(cords, room)
+
+
+TILE_TYPES = [EmptyTile, MaterialTile, RockTile, FoodTile, NestTile]
+TILE_CODES = {tile_type: i for i, tile_type in enumerate(TILE_TYPES)}
+# Walk cost of every tile type, 0 for tiles that can't be walked on.
+WALK_COSTS = np.array([tile_type.settings.walk_cost if tile_type.settings.walkable else 0
+                       for tile_type in TILE_TYPES], dtype=np.uint8)
+# Tile types that have to be updated every tick.
+ACTIVE = np.array([tile_type.settings.interactable or tile_type.settings.tick_logic
+                   for tile_type in TILE_TYPES], dtype=bool)
+# Source of TileGrid versions, unique across all grids.
+_versions = itertools.count(1)
+
+
+class TileGrid(Mapping):
+    """
+        Room's tiles as arrays: tile type codes (index in TILE_TYPES), occupancy and walk cost.
+        Behaves like a read-only dict of (x, y) to Tile, tiles are created on access; use set() to change a tile.
+        Coordinates of tiles that have to be updated every tick are kept in active.
+        version changes whenever tile types change, caches built from the grid compare it to know they're stale.
+    """
+
+    def __init__(self, dimensions, room=None):
+        self.dimensions = tuple(dimensions)
+        self.room = room
+        self.types = np.zeros(self.dimensions, dtype=np.uint8)
+        self.occupied = np.zeros(self.dimensions, dtype=bool)
+        self.walk_cost = np.full(self.dimensions, WALK_COSTS[0], dtype=np.uint8)
+        self.active = set()
+        self.version = next(_versions)
+
+    def __getitem__(self, cords) -> Tile:
+        x, y = cords
+        if not (0 <= x < self.dimensions[0] and 0 <= y < self.dimensions[1]):
+            raise KeyError(cords)
+        return TILE_TYPES[self.types[x, y]]((x, y), self.room)
+
+    def __iter__(self):
+        return ((x, y) for x in range(self.dimensions[0]) for y in range(self.dimensions[1]))
+
+    def __len__(self):
+        return self.dimensions[0] * self.dimensions[1]
+
+    def set(self, cords, tile_type) -> None:
+        """
+            Change tile's type, tile stays (un)occupied.
+        """
+        self.types[cords] = TILE_CODES[tile_type]
+        self.walk_cost[cords] = WALK_COSTS[self.types[cords]]
+        if ACTIVE[self.types[cords]]:
+            self.active.add(tuple(cords))
+        else:
+            self.active.discard(tuple(cords))
+        self.version = next(_versions)
+        if self.room is not None:
+            self.room.mark_dirty()
+
+    def fill(self, tile_type) -> None:
+        """
+            Make every tile of the grid the same type.
+        """
+        self.types[:] = TILE_CODES[tile_type]
+        self.walk_cost[:] = WALK_COSTS[TILE_CODES[tile_type]]
+        self.active = set(self) if ACTIVE[TILE_CODES[tile_type]] else set()
+        self.version = next(_versions)
+        if self.room is not None:
+            self.room.mark_dirty()
+
+    def load(self, types, occupied) -> None:
+        """
+            Replace grid's arrays.
+        """
+        self.types[:] = types
+        self.occupied[:] = occupied
+        self.walk_cost[:] = WALK_COSTS[self.types]
+        self.active = set(map(tuple, np.argwhere(ACTIVE[self.types]).tolist()))
+        self.version = next(_versions)
+
+    def load_area(self, area, types, occupied) -> None:
+        """
+            Replace a part of grid's arrays.
+
+        :param area: Pair of slices of the replaced part
+        """
+        self.types[area] = types
+        self.occupied[area] = occupied
+        self.walk_cost[area] = WALK_COSTS[self.types[area]]
+        (x0, x1, _), (y0, y1, _) = (part.indices(size) for part, size in zip(area, self.dimensions))
+        self.active = {cords for cords in self.active if not (x0 <= cords[0] < x1 and y0 <= cords[1] < y1)}
+        self.active |= {(x0 + x, y0 + y) for x, y in np.argwhere(ACTIVE[self.types[area]]).tolist()}
+        self.version = next(_versions)
@@ -1,9 +1,12 @@
+from collections import OrderedDict
+
+import numpy as np
 import pygame as pg
 import pygame.math
 
 import ui.game_objects as g_objects
 from misc.ProjSettings import RenderingSettings as rs
-from misc.ProjSettings import RoomSettings
+from tiles import TILE_TYPES
 import threading as thr
 import math
 import multiprocessing as mp
@@ -12,6 +15,8 @@ _escaped = False
 events = {}
 draw_requests = []
 known_rooms = {}
+# Colour of every tile type, indexed by tile type code.
+TILE_COLORS = np.array([tile_type.settings.color for tile_type in TILE_TYPES], dtype=np.uint8)
 
 
 def toFixed(numObj, digits=0):
@@ -64,11 +69,12 @@ class Camera(pg.Surface):
         if abs(self.velocity.y) < .01: self.velocity.y = 0
         if abs(self.velocity.z) < .01: self.velocity.z = 0
 
-    def get_gridset(self):
-        rect_cords = (int(math.ceil((self.position.x - (self.get_width() / self.position.z)/2) // rs.room_size[0])),
-                      int(math.ceil((self.position.y - (self.get_height() / self.position.z)/2) // rs.room_size[1])),
-                      int(math.ceil((self.position.x + (self.get_width() / self.position.z)/2) / rs.room_size[0])),
-                      int(math.ceil((self.position.x + (self.get_height() / self.position.z)/2) / rs.room_size[1])))
+    def get_gridset(self, zoom=None):
+        zoom = zoom or self.position.z
+        rect_cords = (int(math.ceil((self.position.x - (self.get_width() / zoom)/2) // rs.room_size[0])),
+                      int(math.ceil((self.position.y - (self.get_height() / zoom)/2) // rs.room_size[1])),
+                      int(math.ceil((self.position.x + (self.get_width() / zoom)/2) / rs.room_size[0])),
+                      int(math.ceil((self.position.y + (self.get_height() / zoom)/2) / rs.room_size[1])))
         cords = []
         for x in range(rect_cords[0], rect_cords[2]):
             for y in range(rect_cords[1], rect_cords[3]):
@@ -76,23 +82,111 @@ class Camera(pg.Surface):
         return rect_cords, cords
 
     def get_surface(self, scene):
-        rect_cords, cords = self.get_gridset()
-        grid_surface = pg.Surface((rect_cords[0]*RoomSettings.dimensions[0], rect_cords[1]*RoomSettings.dimensions[1]))
-        for c in cords:
-            if c not in known_rooms:
-                continue
-
-        return grid_surface
-
-
-
-camera = Camera()
-pg.init()
+        """
+            Draw visible rooms into the camera, one blit of a baked surface (see RoomSurfaces) per room.
+        """
+        zoom = scene.rooms.zoom_level(self.position.z)
+        width, height = rs.room_size[0] * zoom, rs.room_size[1] * zoom
+        left = self.get_width() / 2 - self.position.x * zoom
+        top = self.get_height() / 2 - self.position.y * zoom
+        self.fill((0, 0, 0))
+        for cords in self.get_gridset(zoom)[1]:
+            room = known_rooms.get(cords)
+            # Rooms that are still being generated are placeholder dicts.
+            if hasattr(room, 'tiles'):
+                self.blit(scene.rooms.surface(room, zoom), (round(left + cords[0] * width),
+                                                            round(top + cords[1] * height)))
+        return self
+
+
+class RoomSurfaces:
+    """
+        Baked rooms: every room's tiles, with layout's walls on top, are drawn once into a surface of a pixel per
+        tile, which is scaled to the zoom levels (multiples of zoom_step up to max_zoom) the camera uses. Surfaces
+        are baked again when room's tiles (see TileGrid.version) or layout change; least recently used ones are
+        dropped once they take more than max_bytes.
+        Used by both the render and the draw thread.
+    """
+
+    def __init__(self, max_bytes, zoom_step=.25, max_zoom=3.):
+        self.max_bytes = max_bytes
+        self.zoom_step = zoom_step
+        self.max_zoom = max_zoom
+        self.surfaces: OrderedDict[tuple, tuple[tuple, pg.Surface]] = OrderedDict()
+        self.bytes = 0
+        self.lock = thr.Lock()
+
+    def zoom_level(self, z) -> float:
+        """
+            Zoom level closest to camera's zoom.
+        """
+        return min(max(round(z / self.zoom_step), 1) * self.zoom_step, self.max_zoom)
+
+    def _get(self, key, version):
+        cached = self.surfaces.get(key)
+        if cached is None or cached[0] != version:
+            return None
+        self.surfaces.move_to_end(key)
+        return cached[1]
+
+    def _put(self, key, version, surface) -> None:
+        replaced = self.surfaces.pop(key, None)
+        if replaced is not None:
+            self.bytes -= replaced[1].get_bytesize() * replaced[1].get_width() * replaced[1].get_height()
+        self.surfaces[key] = (version, surface)
+        self.bytes += surface.get_bytesize() * surface.get_width() * surface.get_height()
+        while self.bytes > self.max_bytes and len(self.surfaces) > 1:
+            _, (_, dropped) = self.surfaces.popitem(last=False)
+            self.bytes -= dropped.get_bytesize() * dropped.get_width() * dropped.get_height()
+
+    def surface(self, room, zoom) -> pg.Surface:
+        """
+            Room's tiles at a zoom level, baked if they aren't cached or changed since.
+        """
+        version = (room.tiles.version, id(room.layout))
+        with self.lock:
+            scaled = self._get((room.cords, zoom), version)
+            if scaled is not None:
+                return scaled
+            tiles = self._get((room.cords, None), version)
+            if tiles is None:
+                colors = TILE_COLORS[room.tiles.types]
+                if isinstance(room.layout, np.ndarray):
+                    colors[room.layout != 0] = rs.wall_color
+                tiles = pg.surfarray.make_surface(colors)
+                self._put((room.cords, None), version, tiles)
+            scaled = pg.transform.scale(tiles, (round(rs.room_size[0] * zoom), round(rs.room_size[1] * zoom)))
+            if pg.display.get_surface() is not None:
+                scaled = scaled.convert()
+            self._put((room.cords, zoom), version, scaled)
+            return scaled
+
+    def bake(self, rooms, zoom) -> None:
+        """
+            Bake generated rooms that arrived or changed, so the draw thread only blits them.
+        """
+        for room in rooms.values():
+            if hasattr(room, 'tiles'):
+                self.surface(room, zoom)
+
+
+camera = None
+
+
+def init():
+    """
+        Initialize pygame and the camera, called by RenderThread so importing this module has no side effects.
+    """
+    global camera
+    if camera is None:
+        pg.init()
+        camera = Camera()
 
 
 class DrawThread(thr.Thread):
-    def __init__(self):
+    def __init__(self, scene):
         super(DrawThread, self).__init__(daemon=True)
+        self.scene = scene
         self.clock = pg.time.Clock()
         if rs.fullscreen:
             self.display = pg.display.set_mode(size=(0, 0), flags=pg.FULLSCREEN | pg.DOUBLEBUF | pg.HWACCEL)
@@ -101,24 +195,25 @@ class DrawThread(thr.Thread):
 
     def run(self):
         color = (0, 0, 0)
-        scene = BaseScene()
         while not _escaped:
             dt = self.clock.tick(rs.framerate) * .001 * rs.framerate
             camera.update(dt)
             self.display.fill(color)
-            self.display.blit(camera.get_surface(scene), (0, 0))
+            self.display.blit(camera.get_surface(self.scene), (0, 0))
             pg.display.flip()
 
 
 class RenderThread(thr.Thread):
     def __init__(self, world):
         super(RenderThread, self).__init__(daemon=True, name='Antsy Rendering')
+        init()
         self.clock = pg.time.Clock()
         self.world = world
 
     def run(self) -> None:
         global _escaped, events, known_rooms
-        draw_thr = DrawThread()
+        scene = BaseScene()
+        draw_thr = DrawThread(scene)
         draw_thr.start()
 
         while not _escaped:
@@ -137,6 +232,7 @@ class RenderThread(thr.Thread):
                 elif events[pg.K_d]:
                     camera.local_move(.3, 0)
             known_rooms = self.world.get_rooms(camera.get_gridset()[1])
+            scene.rooms.bake(known_rooms, scene.rooms.zoom_level(camera.position.z))
 
             self.clock.tick(rs.framerate // 2)
 
@@ -149,6 +245,6 @@ class RenderThread(thr.Thread):
 
 class BaseScene:
     def __init__(self):
-        self.tiles = {}
+        self.rooms = RoomSurfaces(rs.room_cache_bytes, rs.zoom_step, camera.max_position.z)
         self.entities = {}
         self.ui = {}
@@ -1,14 +1,31 @@
+import os
+import queue
 import time
-from functools import cached_property
+from collections import deque
+
+import numpy as np
 
 import worldgen
 from misc import ProjSettings
 import pickle as pkl
 from pathlib import Path
 from misc.Paths import cwd
-from tiles import EmptyTile
+from lifeforms import AntPopulation
+from pathfinding import FlowFields, Pathfinder
+from pheromones import Pheromones
+from storage import RegionStore
+from tiles import EmptyTile, TileGrid
 import threading as thr
 
+# WorldSettings that identify a saved world. name and seed are random class attributes, so they aren't pickled
+# with the settings' instance and have to be saved explicitly.
+SAVED_SETTINGS = ('name', 'seed', 'dimensions', 'save_region_size')
+
+
+def saved_settings(settings) -> dict:
+    return {name: getattr(settings, name) for name in SAVED_SETTINGS}
+
+
 neighbors = lambda x, y, d: sum([int(d[x2, y2]) for x2 in range(x - 1, x + 2)
                                               for y2 in range(y - 1, y + 2)
                                               if (-1 < x < ProjSettings.WorldSettings.dimensions[0] and
@@ -17,33 +34,154 @@ neighbors = lambda x, y, d: sum([int(d[x2, y2]) for x2 in range(x - 1, x + 2)
                                                   (0 <= x2 < ProjSettings.WorldSettings.dimensions[0]) and
                                                   (0 <= y2 < ProjSettings.WorldSettings.dimensions[1]))])
 
+class TimerWheel:
+    """
+        Hashed timer wheel, keeps tiles' cords scheduled for future ticks.
+        Adding and firing a timer is O(1), timers further than the wheel's size wait for extra turns in their slot.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self.slots = [[] for _ in range(size)]
+        self.tick = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, tick, cords) -> None:
+        tick = max(tick, self.tick)
+        self.slots[tick % self.size].append((tick, cords))
+        self.count += 1
+
+    def advance(self, tick) -> list:
+        """
+            Move to the tick and take all timers that are due up to and including it.
+        """
+        due = []
+        if not self.count:
+            self.tick = tick + 1
+            return due
+        for t in range(self.tick, tick + 1) if tick - self.tick < self.size else range(self.size):
+            slot = self.slots[t % self.size]
+            if not slot:
+                continue
+            ready = [timer for timer in slot if timer[0] <= tick]
+            if ready:
+                slot[:] = [timer for timer in slot if timer[0] > tick]
+                due.extend(ready)
+        self.tick = tick + 1
+        self.count -= len(due)
+        due.sort(key=lambda timer: timer[0])
+        return due
+
+
 class Room:
     def __init__(self, cords):
         self.layout = {}
         self.ants = {}
-        self.tiles = {}
         self.settings = ProjSettings.RoomSettings()
+        self.tiles = TileGrid(self.settings.dimensions, self)
         self.cords = cords
+        self.dirty = True
+        self.changes = None
+        self.timers = TimerWheel()
+        self.last_update = -1
+
+    def mark_dirty(self) -> None:
+        """
+            Mark room as changed since the last save.
+        """
+        self.dirty = True
+        if self.changes is not None:
+            self.changes.add(self.cords)
 
     def update(self, tick, world, events=None) -> None:
         if events is None:
             events = []
-        [tile.update(tick, world, events) for tile in self.tiles.values()]
-        if len(self.ants) / self.settings.max_ants >= self.settings.ant_halt:
-            if tick % 3 == 0:
-                [ant.update() for ant in self.ants.values()]
-        [ant.update() for ant in self.ants.values()]
+        self.last_update = tick
+        [self.tiles[cords].update(tick, world, events) for cords in list(self.tiles.active)]
+        [self.tiles[cords].tick_logic(tick, world, events) for _, cords in self.timers.advance(tick)]
+
+    def catch_up(self, tick, world, events=None) -> None:
+        """
+            Fast-forward a dormant room to the tick before the current one: fire timers it missed in order and let
+            active tiles catch up in one call each.
+        """
+        elapsed = tick - self.last_update - 1
+        if elapsed <= 0:
+            return
+        if events is None:
+            events = []
+        [self.tiles[cords].tick_logic(t, world, events) for t, cords in self.timers.advance(tick - 1)]
+        [self.tiles[cords].catch_up(tick - 1, elapsed, world, events) for cords in list(self.tiles.active)]
+        self.last_update = tick - 1
 
     def generate(self) -> None:
-        for x in range(self.settings.dimensions[0]):
-            for y in range(self.settings.dimensions[1]):
-                cords = (x, y)
-                self.tiles[cords] = EmptyTile(cords)
+        self.tiles.fill(EmptyTile)
+
+    @property
+    def nbytes(self) -> int:
+        """
+            Memory taken by room's arrays.
+        """
+        layout = self.layout.nbytes if isinstance(self.layout, np.ndarray) else 0
+        return layout + self.tiles.types.nbytes + self.tiles.occupied.nbytes + self.tiles.walk_cost.nbytes
 
-    @cached_property
+    def dump(self) -> dict:
+        """
+            Room as a dict of compact arrays, see Room.restore().
+        """
+        arrays = {'room': np.array([ROOM_TYPES.index(type(self))], dtype=np.uint8),
+                  'tiles': self.tiles.types.copy(), 'occupied': np.packbits(self.tiles.occupied),
+                  'last_update': np.array([self.last_update], dtype=np.int64)}
+        if isinstance(self.layout, np.ndarray):
+            arrays['layout'] = np.packbits(self.layout)
+        if len(self.timers):
+            arrays['timers'] = np.array([(t, *cords) for slot in self.timers.slots for t, cords in slot],
+                                        dtype=np.int64)
+        return arrays
+
+    @staticmethod
+    def restore(cords, arrays) -> 'Room':
+        """
+            Create a room from arrays made by Room.dump().
+        """
+        room = ROOM_TYPES[int(arrays['room'][0])](cords)
+        room.load(arrays)
+        room.dirty = False
+        return room
+
+    def load(self, arrays) -> None:
+        """
+            Replace room's state with arrays made by Room.dump(), room's type isn't changed.
+        """
+        width, height = self.settings.dimensions
+        if 'layout' in arrays:
+            self.layout = np.unpackbits(arrays['layout'], count=width * height).reshape(width, height)
+        self.tiles.load(arrays['tiles'], np.unpackbits(arrays['occupied'], count=width * height).reshape(width, height))
+        self.last_update = int(arrays['last_update'][0]) if 'last_update' in arrays else -1
+        self.timers = TimerWheel()
+        for t, x, y in arrays.get('timers', np.zeros((0, 3), dtype=np.int64)).tolist():
+            self.timers.add(t, (x, y))
+
+    def field(self, name):
+        """
+            Room's per-tile array: 'layout', any of TileGrid's arrays ('types', 'occupied', 'walk_cost') or 'cost',
+            a new array of walk costs with layout's walls set to 0 (not walkable).
+        """
+        if name == 'cost':
+            return np.where(self.field('layout'), 0, self.tiles.walk_cost).astype(np.uint8)
+        if name == 'layout':
+            if not isinstance(self.layout, np.ndarray):
+                self.layout = np.zeros(self.settings.dimensions, dtype=np.uint8)
+            return self.layout
+        return getattr(self.tiles, name)
+
+    @property
     def translated(self):
         translated = {}
-        for (x, y), tile in self.tiles:
+        for (x, y), tile in self.tiles.items():
             translated[((x + (self.settings.dimensions[0] * self.cords[0])),
                         (y + (self.settings.dimensions[1] * self.cords[1])))] = tile
         return translated
@@ -58,22 +196,166 @@ class ColonialRoom(Room):
         self.settings = ProjSettings.ColonialRoomSettings()
 
 
+ROOM_TYPES = [Room, ColonialRoom]
+
+
+class SimulationPolicy:
+    """
+        Decides which rooms are simulated every tick: rooms around colonies, around rooms with ants and around
+        the camera's view. Other rooms stay dormant and catch up when they become active again (see Room.catch_up).
+        Radii are in rooms.
+    """
+
+    def __init__(self, colony_radius=2, ant_radius=1, camera_radius=1):
+        self.colony_radius = colony_radius
+        self.ant_radius = ant_radius
+        self.camera_radius = camera_radius
+
+    def active(self, world) -> set:
+        """
+            Cords of rooms to simulate this tick.
+        """
+        areas = [(c[0] - self.colony_radius, c[1] - self.colony_radius,
+                  c[0] + self.colony_radius + 1, c[1] + self.colony_radius + 1) for c in world.colonies]
+        # Rooms of all ants, ants spawned or loaded away from the other areas included.
+        rooms = world.ants.rooms()
+        rooms = rooms[np.unique(rooms[:, 0] * 2 ** 32 + rooms[:, 1], return_index=True)[1]].tolist()
+        areas += [(x - self.ant_radius, y - self.ant_radius, x + self.ant_radius + 1, y + self.ant_radius + 1)
+                  for x, y in rooms]
+        if world.view is not None:
+            x0, y0, x1, y1 = world.view
+            areas.append((x0 - self.camera_radius, y0 - self.camera_radius,
+                          x1 + self.camera_radius, y1 + self.camera_radius))
+        active = set()
+        for x0, y0, x1, y1 in areas:
+            active |= {(x, y) for x in range(x0, x1) for y in range(y0, y1)
+                       if isinstance(world.rooms.get((x, y)), Room)}
+        return active
+
+
+class Residency:
+    """
+        Keeps the amount of rooms in memory under max_rooms (and max_bytes, if set). Rooms furthest from the view
+        are evicted first, rooms that are being simulated and colonies are never evicted. Changed rooms are saved
+        before eviction, evicted rooms are loaded back from the save when they are requested again.
+        Evicts down to low_watermark of the budget at once, so it doesn't have to run every tick.
+    """
+
+    def __init__(self, max_rooms, max_bytes=None, low_watermark=.9):
+        self.max_rooms = max_rooms
+        self.max_bytes = max_bytes
+        self.low_watermark = low_watermark
+
+    def budget(self, room_bytes) -> int:
+        if self.max_bytes is None:
+            return self.max_rooms
+        return min(self.max_rooms, self.max_bytes // max(room_bytes, 1))
+
+    def victims(self, world) -> list:
+        """
+            Cords of rooms to evict, furthest first.
+        """
+        resident = [cords for cords, room in world.rooms.items() if isinstance(room, Room)]
+        if not resident:
+            return []
+        budget = self.budget(world.rooms[resident[0]].nbytes)
+        if len(resident) <= budget:
+            return []
+        x0, y0, x1, y1 = world.view or (0, 0, 1, 1)
+        center = ((x0 + x1) / 2, (y0 + y1) / 2)
+        protected = world.active | world.colonies
+        candidates = sorted((cords for cords in resident if cords not in protected),
+                            key=lambda c: -max(abs(c[0] + .5 - center[0]), abs(c[1] + .5 - center[1])))
+        return candidates[:len(resident) - int(budget * self.low_watermark)]
+
+
 class WorldUpdater(thr.Thread):
-    def __init__(self, world):
+    """
+        Runs World.update at a fixed tick rate (ticks per second), or as fast as possible if the rate is 0.
+        A tick that runs late doesn't make following ticks run faster to catch up.
+    """
+
+    def __init__(self, world, tick_rate=0.):
         super(WorldUpdater, self).__init__(daemon=True)
         self.killed = thr.Event()
         self.world = world
+        self.tick_rate = tick_rate
+        self.durations = deque(maxlen=1000)
+        self.ticks = 0
+        self.started = 0.
 
     def run(self) -> None:
-        i = 0
+        self.started = next_tick = time.perf_counter()
         while not self.killed.is_set():
-            i += 1
-            self.world.get_generated()
-            time.sleep(1/60)
-            if not i % 120:
+            start = time.perf_counter()
+            with self.world.lock:
                 self.world.update()
-            if i > 1000:
-                i = 0
+            self.ticks += 1
+            end = time.perf_counter()
+            self.durations.append(end - start)
+            if self.tick_rate:
+                next_tick = max(next_tick + 1 / self.tick_rate, end)
+                self.killed.wait(next_tick - end)
+
+    def timings(self) -> dict:
+        """
+            Tick timings in seconds over the last (up to 1000) ticks and the achieved tick rate.
+        """
+        durations = sorted(self.durations)
+        if not durations:
+            return {'ticks': self.ticks, 'tick_rate': 0., 'mean': 0., 'p99': 0., 'max': 0.}
+        return {'ticks': self.ticks, 'tick_rate': self.ticks / max(time.perf_counter() - self.started, 1e-9),
+                'mean': sum(durations) / len(durations), 'p99': durations[int(len(durations) * .99)],
+                'max': durations[-1]}
+
+    def halt(self):
+        self.killed.set()
+
+
+class RoomIngestor(thr.Thread):
+    """
+        Waits on the generator's output and puts generated rooms into the world as soon as they arrive.
+    """
+
+    def __init__(self, world):
+        super(RoomIngestor, self).__init__(daemon=True, name='Antsy Ingestor')
+        self.killed = thr.Event()
+        self.world = world
+
+    def run(self) -> None:
+        while not self.killed.is_set():
+            generator = self.world.generator
+            try:
+                cords, slot = generator.output.get(timeout=.1)
+            except queue.Empty:
+                continue
+            with self.world.lock:
+                self.world.ingest(generator, cords, slot)
+
+    def halt(self):
+        self.killed.set()
+
+
+class AutoSaver(thr.Thread):
+    """
+        Periodically saves rooms changed since the last save (see World.save()) and, more often, evicts rooms over
+        the residency budget (see World.evict()), so neither runs on the tick thread.
+    """
+
+    def __init__(self, world, interval, evict_interval=1.):
+        super(AutoSaver, self).__init__(daemon=True, name='Antsy Autosave')
+        self.killed = thr.Event()
+        self.world = world
+        self.interval = interval
+        self.evict_interval = evict_interval
+
+    def run(self) -> None:
+        last_save = time.perf_counter()
+        while not self.killed.wait(min(self.interval, self.evict_interval)):
+            self.world.evict()
+            if time.perf_counter() - last_save >= self.interval:
+                self.world.save()
+                last_save = time.perf_counter()
 
     def halt(self):
         self.killed.set()
@@ -82,61 +364,411 @@ class WorldUpdater(thr.Thread):
 class World:
     def __init__(self, sim_settings, world_settings):
         self.tick = 0
-        self.rooms: dict[tuple[int, int], dict] = {}
-        self.events = []
+        self.rooms: dict[tuple[int, int], dict | Room] = {}
+        self.events = deque(maxlen=sim_settings.max_events)
         self.sim_settings = sim_settings
         self.settings = world_settings
+        self.path = Path(cwd, self.sim_settings.name, self.settings.name)
+        self.store = RegionStore(Path(self.path, 'regions'), self.settings.save_region_size)
+        self.saved = set()
+        self.evicting = {}
+        self.dirty = set()
+        self.lock = thr.RLock()
+        self.save_lock = thr.Lock()
+        self.last_save_duration = 0.
+        self.last_save_bytes = 0
+        self.policy = SimulationPolicy(self.sim_settings.colony_radius, self.sim_settings.ant_radius,
+                                       self.sim_settings.camera_radius)
+        self.active = set()
+        self.colonies = set()
+        self.view = None
+        self.residency = Residency(self.sim_settings.max_resident_rooms, self.sim_settings.max_resident_bytes)
+        self.ants = AntPopulation(self.sim_settings.room_settings.dimensions,
+                                  seed=worldgen.derive_seed(self.settings.seed),
+                                  cell_size=self.sim_settings.spatial_cell)
+        self.pathfinder = Pathfinder(self, self.sim_settings.path_cache_rooms)
+        self.flow_fields = FlowFields(self, self.sim_settings.max_flow_fields)
+        self.pheromones = self.new_pheromones()
+        self.shards = None
+        if self.sim_settings.simulation_processes:
+            from sharding import ShardedSimulation
+            self.shards = ShardedSimulation(self.sim_settings.simulation_processes, self.sim_settings.shard_block,
+                                            self.sim_settings.ghost_width, worldgen.derive_seed(self.settings.seed),
+                                            self.sim_settings)
         self.generator = worldgen.WorldGenHandler(self.settings)
-        self.updater = WorldUpdater(self)
+        self.updater = WorldUpdater(self, self.sim_settings.tick_rate)
+        self.ingestor = RoomIngestor(self)
+        self.autosaver = AutoSaver(self, self.sim_settings.autosave_interval, self.sim_settings.evict_interval)
         self.__create()
 
 
     def update(self) -> None:
-        print(self.rooms.keys())
-        return
-        for k, v in self.rooms.items():
-            v.update(self.tick, self, self.events)
+        """
+            Simulate one tick of rooms chosen by the policy, rooms that were dormant catch up first.
+            With simulation processes, active rooms are ticked by the shards and resident rooms are their mirrors.
+        """
+        self.active = self.policy.active(self)
+        if self.shards is not None:
+            self.shards.update(self)
+            self.tick += 1
+            return
+        for cords in self.active:
+            room = self.rooms[cords]
+            room.catch_up(self.tick, self, self.events)
+            room.update(self.tick, self, self.events)
+        # Pheromones are saved with their room, see dump_room().
+        [self.rooms[cords].mark_dirty() for cords in self.pheromones.step(self.tick, self.active)]
+        self.ants.step(self, self.tick, self.active)
         self.tick += 1
 
+    def new_pheromones(self) -> Pheromones:
+        return Pheromones(self.sim_settings.room_settings.dimensions, self.sim_settings.pheromone_diffusion,
+                          self.sim_settings.pheromone_evaporation, self.sim_settings.pheromone_threshold)
+
     def save(self) -> None:
-        world_obj = {'tick': self.tick, 'rooms': self.rooms, 'settings': self.settings, 'events': self.events}
-        Path(cwd, self.sim_settings.name, self.settings.name).mkdir(parents=True, exist_ok=True)
+        """
+            Save world's state to world.pk and rooms changed since the last save to region files.
+            Simulation is only paused while changed rooms are copied, writing happens on the caller's thread.
+        """
+        with self.save_lock:
+            start = time.perf_counter()
+            with self.lock:
+                dirty = set(self.dirty)
+                self.dirty.clear()
+                rooms = {cords: self.rooms[cords] for cords in dirty if isinstance(self.rooms.get(cords), Room)}
+                snapshot = {cords: self.dump_room(cords) for cords in rooms}
+                for room in rooms.values():
+                    room.dirty = False
+                world_obj = {'tick': self.tick, 'settings': self.settings, 'world': saved_settings(self.settings),
+                             'events': list(self.events),
+                             'ants': self.ants.rows()}
+            try:
+                self.path.mkdir(parents=True, exist_ok=True)
+                # Written next to the old one and swapped in, so a crash mid-write doesn't lose the save.
+                temp = Path(self.path, 'world.tmp')
+                with open(temp, 'wb+') as savefile:
+                    pkl.dump(world_obj, savefile)
+                    written = savefile.tell()
+                os.replace(temp, Path(self.path, 'world.pk'))
+                written += self.store.save(snapshot)
+            except Exception:
+                [room.mark_dirty() for room in rooms.values()]
+                raise
+            self.saved |= snapshot.keys()
+            self.last_save_bytes = written
+            self.last_save_duration = time.perf_counter() - start
+
+    def evict(self) -> int:
+        """
+            Drop rooms chosen by the residency policy from memory, changed rooms are saved first.
+            Called on the autosave thread; rooms are written outside of the world's lock, so ticks and rendering
+            don't wait for the disk.
+
+        :return: Amount of evicted rooms
+        """
+        with self.lock:
+            if not self.residency.victims(self):
+                return 0
+        with self.save_lock:
+            with self.lock:
+                victims = self.residency.victims(self)
+                changed = {cords: self.dump_room(cords) for cords in victims
+                           if self.rooms[cords].dirty or cords not in self.saved}
+                for cords in victims:
+                    self.pheromones.take(cords)
+                    del self.rooms[cords]
+                    self.dirty.discard(cords)
+                # Rooms requested again before they are written are restored from these, see read_rooms().
+                self.evicting |= changed
+            try:
+                self.store.save(changed)
+            except Exception:
+                with self.lock:
+                    for cords in changed:
+                        arrays = self.evicting.pop(cords)
+                        if cords not in self.rooms:
+                            self.restore_room(cords, arrays).mark_dirty()
+                raise
+            with self.lock:
+                self.saved |= changed.keys()
+                for cords, arrays in changed.items():
+                    if self.evicting.get(cords) is arrays:
+                        del self.evicting[cords]
+            return len(victims)
 
-        with open(Path(cwd, self.sim_settings.name, self.settings.name, 'data.pk'), 'wb+') as savefile:
-            pkl.dump(world_obj, savefile)
+    def load(self, path=None) -> None:
+        """
+            Load world's state, rooms are read from region files only when they are requested.
 
-    def load(self) -> None:
-        with open(Path(cwd, self.settings.name, 'data.pk'), 'rb') as savefile:
+        :param path: World's save directory, or world's name in simulation's directory; this world's if None
+        """
+        path = self.path if path is None else Path(cwd, self.sim_settings.name, path) if isinstance(path, str) \
+            else Path(path)
+        with open(Path(path, 'world.pk'), 'rb') as savefile:
             world_obj = pkl.load(savefile)
-            self.__dict__ |= world_obj
-        self.generator.halt()
-        self.generator.join()
-        del self.generator
-        self.generator = worldgen.WorldGenHandler(self.settings)
+        with self.save_lock, self.lock:
+            self.tick = world_obj['tick']
+            self.settings = world_obj['settings']
+            for name, value in world_obj.get('world', {}).items():
+                setattr(self.settings, name, value)
+            self.path = path
+            self.store = RegionStore(Path(self.path, 'regions'), self.settings.save_region_size)
+            self.events = deque(world_obj['events'], maxlen=self.sim_settings.max_events)
+            self.ants = AntPopulation(self.sim_settings.room_settings.dimensions,
+                                      seed=worldgen.derive_seed(self.settings.seed),
+                                      cell_size=self.sim_settings.spatial_cell)
+            if 'ants' in world_obj:
+                self.ants.put(world_obj['ants'])
+            self.pheromones = self.new_pheromones()
+            self.pheromones.tick = self.tick
+            self.rooms = {}
+            self.active = set()
+            self.colonies = set()
+            self.dirty.clear()
+            self.saved = self.store.stored()
+            self.evicting = {}
+            generator, self.generator = self.generator, worldgen.WorldGenHandler(self.settings)
+            self.generator.start()
+        generator.halt()
+        generator.join()
+        generator.slab.close()
+
+    def migrate(self, source, key, target) -> bool:
+        """
+            Move an ant to another room.
 
-    @cached_property
+        :param source: Cords of ant's room
+        :param key: Ant's key in room's ants
+        :param target: Cords of the room the ant moves to
+        :return: False if the target room isn't resident, the ant stays in its room then
+        """
+        room = self.rooms.get(target)
+        if not isinstance(room, Room):
+            return False
+        room.ants[key] = self.rooms[source].ants.pop(key)
+        self.rooms[source].mark_dirty()
+        room.mark_dirty()
+        return True
+
+    def spawn_ants(self, x, y, colony=0, genome=None) -> np.ndarray:
+        """
+            Add ants at global tile coordinates, see AntPopulation.spawn().
+
+        :return: Keys of the new ants
+        """
+        keys = self.ants.spawn(x, y, colony, genome)
+        rooms = self.ants.rooms()[[self.ants.index[key] for key in keys.tolist()]]
+        for key, cords in zip(keys.tolist(), map(tuple, rooms.tolist())):
+            room = self.rooms.get(cords)
+            if isinstance(room, Room):
+                room.ants[key] = self.ants.ant(key)
+                room.mark_dirty()
+        if self.shards is not None:
+            self.shards.spawned_ants(keys.tolist())
+        return keys
+
+    @property
     def all_tiles(self):
+        """
+            Every resident tile by its global coordinates. Builds a new dict on every call,
+            use tile_at(), region() or neighbourhood() instead.
+        """
         tiles = {}
         for room in self.rooms.values():
-            tiles |= room.translated
+            if isinstance(room, Room):
+                tiles |= room.translated
         return tiles
+
+    def get_room(self, cords):
+        """
+            Resident room, or a saved room loaded back into memory; doesn't request generation.
+
+        :return: Room or None if the room isn't generated yet
+        """
+        with self.lock:
+            room = self.rooms.get(cords)
+            if isinstance(room, Room):
+                return room
+            arrays = self.read_rooms([cords]).get(cords)
+            if arrays is not None:
+                return self.restore_room(cords, arrays)
+            return None
+
+    def locate(self, x, y):
+        """
+            Room's cords and local tile's cords of a global tile.
+        """
+        width, height = self.sim_settings.room_settings.dimensions
+        (rx, lx), (ry, ly) = divmod(x, width), divmod(y, height)
+        return (rx, ry), (lx, ly)
+
+    def tile_at(self, x, y):
+        """
+            Tile at global coordinates.
+
+        :return: Tile or None if its room isn't generated yet
+        """
+        cords, local = self.locate(x, y)
+        room = self.get_room(cords)
+        return None if room is None else room.tiles[local]
+
+    def region(self, x0, y0, x1, y1, field='types', fill=0):
+        """
+            Per-tile array of a rectangle of global tiles, x1 and y1 are exclusive.
+            Rectangle inside of a single room is returned as a view of room's array, otherwise rooms' parts are
+            copied into a new array; tiles of missing rooms are set to fill.
+
+        :param field: Array to read, see Room.field()
+        :return: Array indexed by [x - x0, y - y0]
+        """
+        width, height = self.sim_settings.room_settings.dimensions
+        (room_x0, room_y0), (lx0, ly0) = self.locate(x0, y0)
+        if (x1 - 1) // width == room_x0 and (y1 - 1) // height == room_y0:
+            room = self.get_room((room_x0, room_y0))
+            if room is not None:
+                return room.field(field)[lx0:lx0 + x1 - x0, ly0:ly0 + y1 - y0]
+        output = None
+        for rx in range((x0 // width), (x1 - 1) // width + 1):
+            for ry in range((y0 // height), (y1 - 1) // height + 1):
+                room = self.get_room((rx, ry))
+                if room is None:
+                    continue
+                array = room.field(field)
+                if output is None:
+                    output = np.full((x1 - x0, y1 - y0), fill, dtype=array.dtype)
+                gx0, gy0 = max(x0, rx * width), max(y0, ry * height)
+                gx1, gy1 = min(x1, (rx + 1) * width), min(y1, (ry + 1) * height)
+                output[gx0 - x0:gx1 - x0, gy0 - y0:gy1 - y0] = \
+                    array[gx0 - rx * width:gx1 - rx * width, gy0 - ry * height:gy1 - ry * height]
+        if output is None:
+            output = np.full((x1 - x0, y1 - y0), fill, dtype=np.uint8)
+        return output
+
+    def neighbourhood(self, points, field='types', radius=1, fill=0):
+        """
+            Bulk lookup of (2 * radius + 1) squares around many global tiles.
+            Points are grouped by room, every room is read once together with a border of neighbouring rooms' tiles.
+
+        :param points: Array of global (x, y) coordinates, shape (n, 2)
+        :param field: Array to read, see Room.field()
+        :param radius: Radius of the square
+        :return: Array of shape (n, 2 * radius + 1, 2 * radius + 1)
+        """
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        width, height = self.sim_settings.room_settings.dimensions
+        size = 2 * radius + 1
+        output = None
+        rooms = np.stack([points[:, 0] // width, points[:, 1] // height], axis=1)
+        offsets = np.arange(size)
+        _, first, inverse = np.unique(rooms[:, 0] * 2 ** 32 + rooms[:, 1], return_index=True, return_inverse=True)
+        order = np.argsort(inverse.reshape(-1), kind='stable')
+        bounds = np.searchsorted(inverse.reshape(-1)[order], np.arange(len(first) + 1))
+        for i, (rx, ry) in enumerate(rooms[first].tolist()):
+            selected = order[bounds[i]:bounds[i + 1]]
+            area = self.region(rx * width - radius, ry * height - radius,
+                               (rx + 1) * width + radius, (ry + 1) * height + radius, field, fill)
+            if output is None:
+                output = np.empty((len(points), size, size), dtype=area.dtype)
+            lx = points[selected, 0] - rx * width
+            ly = points[selected, 1] - ry * height
+            output[selected] = area[(lx[:, None] + offsets)[:, :, None], (ly[:, None] + offsets)[:, None, :]]
+        if output is None:
+            output = np.empty((0, size, size), dtype=np.uint8)
+        return output
     
-    def get_generated(self):
-        while not self.generator.output.empty():
-            data = self.generator.output.get()
-            self.rooms[data[0]] = data[1]
+    def ingest(self, generator, cords, slot) -> None:
+        """
+            Put a generated room from generator's output into the world.
+        """
+        if generator is not self.generator:
+            # Output of a generator replaced by load(), its rooms aren't needed anymore.
+            return
+        if slot is None:
+            # Request was cancelled by the generator, drop placeholder so the room can be requested again.
+            if isinstance(self.rooms.get(cords), dict):
+                del self.rooms[cords]
+            return
+        if slot < 0:
+            return
+        room = Room(cords)
+        room.layout = generator.slab.take(slot)
+        room.generate()
+        self.add_room(room)
+
+    def add_room(self, room) -> None:
+        """
+            Put a room into the world and track its changes.
+        """
+        room.changes = self.dirty
+        room.ants = {key: self.ants.ant(key) for key in self.ants.in_room(room.cords)}
+        if room.last_update < 0:
+            room.last_update = self.tick - 1
+        self.rooms[room.cords] = room
+        if isinstance(room, ColonialRoom):
+            self.colonies.add(room.cords)
+        if room.dirty:
+            self.dirty.add(room.cords)
     
+    def read_rooms(self, cords) -> dict:
+        """
+            Saved arrays of rooms, rooms evict() is still writing are taken from memory.
+
+        :return: Dict of room's cords to arrays, rooms that weren't saved are missing
+        """
+        pending = {c: self.evicting[c] for c in cords if c in self.evicting}
+        return pending | self.store.load([c for c in cords if c not in pending and c in self.saved])
+
+    def dump_room(self, cords) -> dict:
+        """
+            Room's arrays (see Room.dump()) with its pheromones, see restore_room().
+        """
+        arrays = self.rooms[cords].dump()
+        field = self.pheromones.fields.get(cords)
+        if field is not None:
+            arrays['pheromones'] = field.front.copy()
+            arrays['pheromones_tick'] = np.array([field.tick], dtype=np.int64)
+        return arrays
+
+    def restore_room(self, cords, arrays) -> Room:
+        """
+            Put a room read from region files back into the world, with pheromones it was saved with.
+        """
+        room = Room.restore(cords, arrays)
+        if 'pheromones' in arrays:
+            self.pheromones.put(cords, arrays['pheromones'], int(arrays['pheromones_tick'][0]))
+        self.add_room(room)
+        return room
+
     def get_rooms(self, cords):
-        output = {}
-        for c in cords:
-            if c in self.rooms:
-                output[c] = self.rooms[c]
-            else:
-                self.generator.request(*c)
-                self.rooms[c] = {}
-        return output
-        
+        """
+            Rooms at cords that are in memory or saved, the others are requested from the generator.
+            Called from the render thread (or the main thread when headless), so world is changed under the lock.
 
+        :return: Dict of cords to rooms that are already generated
+        """
+        with self.lock:
+            output = {}
+            if cords:
+                self.view = (min(c[0] for c in cords), min(c[1] for c in cords),
+                             max(c[0] for c in cords) + 1, max(c[1] for c in cords) + 1)
+                self.generator.focus(*self.view)
+            for c, arrays in self.read_rooms([c for c in cords if c not in self.rooms]).items():
+                self.restore_room(c, arrays)
+            missing = []
+            for c in cords:
+                if c in self.rooms:
+                    output[c] = self.rooms[c]
+                else:
+                    missing.append(c)
+                    self.rooms[c] = {}
+            if len(missing) > 1:
+                x0, y0 = min(c[0] for c in missing), min(c[1] for c in missing)
+                x1, y1 = max(c[0] for c in missing) + 1, max(c[1] for c in missing) + 1
+                if (x1 - x0) * (y1 - y0) == len(missing):
+                    self.generator.request_region(x0, y0, x1, y1)
+                    return output
+            [self.generator.request(*c) for c in missing]
+            return output
 
     def __create(self) -> None:
         print(self.settings.name, ':')
@@ -144,12 +776,22 @@ class World:
         print('; \n'.join([': '.join([str(tuple(map(str, cords))), repr(room)]) for cords, room in self.rooms.items()]))
         self.save()
         self.generator.start()
+        self.ingestor.start()
         self.updater.start()
-        self.save()
+        self.autosaver.start()
 
     def quit(self):
+        self.autosaver.halt()
+        self.updater.halt()
+        self.updater.join()
+        if self.shards is not None:
+            with self.lock:
+                self.shards.halt(self)
+        self.ingestor.halt()
+        self.ingestor.join()
         self.generator.halt()
         self.generator.join()
+        self.generator.slab.close()
         del self.generator
         self.save()
 
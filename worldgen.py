@@ -1,84 +1,160 @@
-import copy
 import hashlib
+import heapq
 import multiprocessing as mp
+import queue
 import threading as thr
-from functools import cache, lru_cache
+import time
+from functools import cache
+from multiprocessing import shared_memory
+
+import numpy as np
 
-import random as rnd
 from misc import ProjSettings
 from misc.ProjSettings import SimSettings
 
 import tiles
+from storage import RoomCache
 
 import gc
 
+# Bump whenever generated rooms change for the same seed, cached rooms of other versions are dropped.
+GENERATOR_VERSION = 2
+
 
-def _neighbors(x, y, d, bx=ProjSettings.RoomSettings.dimensions[0], by=ProjSettings.RoomSettings.dimensions[1]):
-    i = 0
-    for x2 in range(x - 1, x + 2):
-        for y2 in range(y - 1, y + 2):
-            if (x != x2 or y != y2) and -1 < x < bx and -1 < y < by and (0 <= x2 < bx) and (0 <= y2 < by):
-                if d[x2, y2]:
-                    i += 1
-    return i
+def derive_seed(seed) -> int:
+    """
+        Derive a fixed-width (64 bit) world seed from any seed value.
 
+    :param seed: World's seed, usually WorldSettings.seed
+    :return: 64 bit integer seed
+    """
+    return int.from_bytes(hashlib.sha256(str(seed).encode('utf-8')).digest()[:8], 'little')
 
-@lru_cache(maxsize=20)
-def _room_neighbors(x, y):
-    output = {}
-    nr = _n_room_neighbors()
-    for i, cords in nr.items():
-        output[i] = (cords[0] + x * ProjSettings.RoomSettings.dimensions[0],
-                     cords[1] + y * ProjSettings.RoomSettings.dimensions[1])
 
-    return output
+def _mix64(h):
+    """
+        SplitMix64 finalizer over an uint64 array.
+    """
+    h ^= h >> np.uint64(30)
+    h *= np.uint64(0xBF58476D1CE4E5B9)
+    h ^= h >> np.uint64(27)
+    h *= np.uint64(0x94D049BB133111EB)
+    h ^= h >> np.uint64(31)
+    return h
+
+
+def noise(w_seed, x0, y0, x1, y1):
+    """
+        Stateless noise, every tile's value depends only on world's seed and tile's global coordinates,
+        so any rectangle (rooms, halos, whole regions) can be filled in a single call.
+
+    :param w_seed: World's seed, see derive_seed()
+    :param x0: Global X coordinate of the first column
+    :param y0: Global Y coordinate of the first row
+    :param x1: Global X coordinate after the last column
+    :param y1: Global Y coordinate after the last row
+    :return: uint8 array of 0 and 1 with shape (x1 - x0, y1 - y0), indexed by [x, y]
+    """
+    xs = np.arange(x0, x1, dtype=np.int64).view(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    ys = np.arange(y0, y1, dtype=np.int64).view(np.uint64) * np.uint64(0xC2B2AE3D27D4EB4F)
+    h = _mix64(xs[:, None] ^ _mix64(ys ^ np.uint64(w_seed))[None, :])
+    return (h >> np.uint64(63)).astype(np.uint8)
 
 
 @cache
-def _n_room_neighbors():
-    output = {}
-    i = 0
-    for x2 in range(-1, 2):
-        for y2 in range(-1, 2):
-            i += 1
-            if not i % 2:
-                output[i] = (x2, y2)
-    return output
-
-
-def check_shape(x, y, d):
-    neighbors = {i: bool(d[cords]) if cords in d else False for i, cords in _n_room_neighbors().items()}
-    match neighbors:
-        case [_, False, _,
-              True, False, False,
-              _, True, _]:
-            return 2
-        case [_, True, _,
-              True, False, False,
-              _, False, _]:
-            return 3
-        case [_, True, _,
-              False, False, True,
-              _, False, _]:
-            return 4
-        case [_, False, _,
-              False, False, True,
-              _, True, _]:
-            return 5
-        case _:
-            return 1
+def _sweep_order(width, height):
+    """
+        Precompute flat indices for one in-place sweep of the cellular automata over a padded grid.
+
+        The automata is applied cell by cell in x-major order, so every cell already sees the updated values of the
+        cells before it. A cell (x, y) only depends on updated cells with a smaller 2x + y, and cells sharing the same
+        2x + y never touch each other, so every such anti-diagonal can be updated at once while keeping the result
+        identical to the sequential sweep.
+
+    :param width: Room's width
+    :param height: Room's height
+    :return: List of (cells, neighbors) index arrays, one per anti-diagonal
+    """
+    stride = height + 2
+    offsets = np.array([dx * stride + dy for dx in range(-1, 2) for dy in range(-1, 2) if dx or dy], dtype=np.intp)
+    order = []
+    for t in range(2 * (width - 1) + height):
+        cells = np.array([(x + 1) * stride + (t - 2 * x) + 1 for x in range(width) if 0 <= t - 2 * x < height],
+                         dtype=np.intp)
+        order.append((cells, (offsets[:, None] + cells[None, :]).ravel()))
+    return order
+
+
+def ca_smooth(grid, passes=2):
+    """
+        Apply B678/S345678 rule to a padded grid in place.
+
+    :param grid: uint8 array of shape (..., width + 2, height + 2); the one cell border is the room's halo
+    :param passes: Amount of sweeps
+    :return: The same grid
+    """
+    width, height = grid.shape[-2] - 2, grid.shape[-1] - 2
+    flat = grid.reshape(-1, (width + 2) * (height + 2))
+    order = _sweep_order(width, height)
+    for _ in range(passes):
+        for cells, neighbors in order:
+            c = flat[:, neighbors].reshape(flat.shape[0], 8, -1).sum(axis=1)
+            flat[:, cells] = (c >= 6) | ((c >= 3) & (flat[:, cells] != 0))
+    return grid
+
+
+class WorkerStats:
+    """
+        Shared counters of a single generation worker, can be read from any thread or process.
+        Load is counted in rooms, a region request adds all of its rooms at once.
+    """
+
+    def __init__(self):
+        self.queued = mp.Value('i', 0)
+        self.busy = mp.Value('i', 0)
+        self.processed = mp.Value('i', 0)
+        self.busy_time = mp.Value('d', 0.)
+        self.started = mp.Value('d', 0.)
+
+    @property
+    def load(self) -> int:
+        return self.queued.value + self.busy.value
+
+    def add_queued(self, amount: int):
+        with self.queued.get_lock():
+            self.queued.value += amount
+
+    def utilisation(self) -> float:
+        """
+            Part of the worker's lifetime spent generating rooms.
+        """
+        if not self.started.value:
+            return 0.
+        return min(self.busy_time.value / max(time.monotonic() - self.started.value, 1e-9), 1.)
 
 
 class _SmartDistributor:
     """
         Class for using a function over a pool of objects, similar to *map()* but executes only once on every call and
         can loop over the pool indefinitely; Use to distribute load over multiple processes/threads.
-        Distributes load depending on how busy the pool is.
-        **Not implemented.**
+        Distributes load depending on how busy the pool is: every call goes to the least loaded object, and while
+        all objects are at capacity the call blocks (backpressure).
     """
 
-    def __init__(self):
-        raise NotImplemented
+    def __init__(self, objects, func, load, capacity, wait=.001):
+        self.objects = objects
+        self.func = func
+        self.load = load
+        self.capacity = capacity
+        self.wait = wait
+
+    def __call__(self, *args, **kwargs):
+        if len(self.objects) == 0: return
+        target = min(self.objects, key=self.load)
+        while self.load(target) >= self.capacity:
+            time.sleep(self.wait)
+            target = min(self.objects, key=self.load)
+        self.func(target, *args, **kwargs)
 
 
 class SimpleDistributor:
@@ -99,26 +175,174 @@ class SimpleDistributor:
         self.pointer += 1
 
 
+def _request_size(request) -> int:
+    """
+        Amount of rooms in a room (x, y) or a region (x0, y0, x1, y1) request.
+    """
+    if len(request) == 4:
+        return max(request[2] - request[0], 0) * max(request[3] - request[1], 0)
+    return 1
+
+
+def _request_rooms(request):
+    """
+        Coordinates of all rooms in a room (x, y) or a region (x0, y0, x1, y1) request.
+    """
+    if len(request) == 4:
+        return [(x, y) for x in range(request[0], request[2]) for y in range(request[1], request[3])]
+    return [tuple(request)]
+
+
+def _submit(worker, *request):
+    """
+        Pass a room (x, y) or a region (x0, y0, x1, y1) request to a worker.
+    """
+    worker.stats.add_queued(_request_size(request))
+    if len(request) == 4:
+        worker.request_region(*request)
+    else:
+        worker.request(*request)
+
+
+class RequestScheduler:
+    """
+        Pending generation requests ordered by their distance (in rooms) to the current view, closest first.
+        Requests that got too far from the view are dropped.
+    """
+
+    def __init__(self, drop_distance):
+        self.drop_distance = drop_distance
+        self.view = (0, 0, 0, 0)
+        self.heap = []
+        self.pending = set()
+        self.counter = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def distance(self, request) -> int:
+        """
+            Chebyshev distance between request's rooms and the view, 0 if they overlap or the view is not set.
+        """
+        x0, y0, x1, y1 = self.view
+        if x1 <= x0 or y1 <= y0:
+            return 0
+        rx0, ry0 = request[0], request[1]
+        rx1, ry1 = (request[2], request[3]) if len(request) == 4 else (rx0 + 1, ry0 + 1)
+        return max(rx0 - x1 + 1, x0 - rx1 + 1, ry0 - y1 + 1, y0 - ry1 + 1, 0)
+
+    def push(self, request):
+        """
+            Add a request, requests that are already pending are ignored.
+        """
+        request = tuple(request)
+        if request in self.pending:
+            return
+        self.pending.add(request)
+        self.counter += 1
+        heapq.heappush(self.heap, (self.distance(request), self.counter, request))
+
+    def pop(self):
+        """
+            Take the closest request.
+        """
+        request = heapq.heappop(self.heap)[2]
+        self.pending.discard(request)
+        return request
+
+    def set_view(self, view) -> list:
+        """
+            Move the view and re-prioritise pending requests.
+
+        :param view: Visible rooms (x0, y0, x1, y1)
+        :return: Dropped requests
+        """
+        view = tuple(view)
+        if view == self.view:
+            return []
+        self.view = view
+        heap, dropped = [], []
+        for _, counter, request in self.heap:
+            distance = self.distance(request)
+            if distance > self.drop_distance:
+                dropped.append(request)
+                self.pending.discard(request)
+            else:
+                heap.append((distance, counter, request))
+        heapq.heapify(heap)
+        self.heap = heap
+        return dropped
+
+
+class RoomSlab:
+    """
+        Fixed-size room slots in shared memory, used to pass generated rooms from workers without pickling them.
+        Worker writes a room into a free slot and sends only the slot's id, consumer reads the slot in place and
+        releases it. When all slots are taken, writers wait for the consumer.
+    """
+
+    def __init__(self, slots, dimensions):
+        self.slots = slots
+        self.dimensions = tuple(dimensions)
+        self.slot_size = self.dimensions[0] * self.dimensions[1]
+        self.memory = shared_memory.SharedMemory(create=True, size=slots * self.slot_size)
+        self.free = mp.Queue()
+        [self.free.put(slot) for slot in range(slots)]
+
+    def view(self, slot: int):
+        """
+            Slot as an uint8 array, without copying it.
+        """
+        return np.ndarray(self.dimensions, dtype=np.uint8, buffer=self.memory.buf, offset=slot * self.slot_size)
+
+    def write(self, grid) -> int:
+        """
+            Copy a room into a free slot.
+
+        :param grid: Room's uint8 array
+        :return: Slot's id
+        """
+        slot = self.free.get()
+        self.view(slot)[:] = grid
+        return slot
+
+    def take(self, slot: int):
+        """
+            Copy a room out of a slot and release the slot.
+        """
+        grid = self.view(slot).copy()
+        self.release(slot)
+        return grid
+
+    def release(self, slot: int):
+        self.free.put(slot)
+
+    def close(self):
+        """
+            Free shared memory, should be called once by the owner after all workers stopped.
+        """
+        self.memory.close()
+        self.memory.unlink()
+
+
 class _WorldGen:
     """
         WorldGenerator, takes coordinates and seed to generate world using B678/S345678 Cellular Automata rule.
     """
 
-    def __init__(self, room_options, seed, output):
+    def __init__(self, room_options, seed, output, slab, stats=None):
         super().__init__()
         self.room_options = room_options
         self.width, self.height = self.room_options.dimensions
         self.seed = seed
         self.requests = mp.Queue()
-        self.world = {}
         self.output = output
-        self.room_cords = [(x, y) for x in range(self.width) for y in range(self.height)]
-        self.n_room_cords = copy.copy(self.room_cords)
-        self.n_room_cords.extend(
-            [(cords[0] + offset_x * self.width // 2, cords[1] + offset_y * self.height // 2)
-             for cords in self.room_cords for offset_x in range(3) for offset_y in range(3) if
-             (cords[0] + offset_x * self.width // 2, cords[1] + offset_y * self.height // 2) not in self.room_cords])
-        self.generated = []
+        self.slab = slab
+        self.generated = set()
+        self.stats = stats or WorkerStats()
+        self.peers = []
+        self.steal_after = .05
+        self.cache = None
 
     def request(self, x: int, y: int):
         """
@@ -130,80 +354,149 @@ class _WorldGen:
         """
         self.requests.put((x, y))
 
-    @lru_cache(maxsize=20)
-    def generate_noise(self, room_seed, offset_x=0, offset_y=0):
+    def request_region(self, x0: int, y0: int, x1: int, y1: int):
         """
-            Generate noise from seed
+            Request a rectangle of rooms to be generated in one pass.
 
-        :param room_seed: Room's seed
-        :param offset_x: Room's offset by X
-        :param offset_y: Room's offset by Y
-        :return: Generated noise (dict)
+            :param x0: X coordinate of the first room
+            :param y0: Y coordinate of the first room
+            :param x1: X coordinate after the last room
+            :param y1: Y coordinate after the last room
         """
-        random = rnd.Random(room_seed)
-        return {(cords[0] + offset_x * self.width, cords[1] + offset_y * self.height): bool(random.randint(0, 1))
-                for cords in self.room_cords}
-
-    @lru_cache(maxsize=200)
-    def generate_room_seed(self, w_seed, cords):
-        return ((cords[0] + 1) << 256 + (cords[1] * ProjSettings.WorldSettings.dimensions[0] + 1) << 128) ^ w_seed
+        self.requests.put((x0, y0, x1, y1))
 
     def generate(self, w_seed, cords):
         """
             Generate cave-like 2D structure based of world seed and it's coordinates
 
-        :param w_seed: World's seed
+        :param w_seed: World's seed, see derive_seed()
         :param cords: Room's coordinates
-        :return: Generated structure (dict)
+        :return: Generated structure (uint8 array indexed by [x, y]), None for rooms outside of the world
         """
         if cords[0] < 0 or cords[1] < 0:
-            return {cords: {}}
-        rn = _room_neighbors(cords[0], cords[1])
-        local_rn = _n_room_neighbors()
-        # random = rnd.Random(w_seed)
-        # [random.random() for _ in range(cords[0] + cords[1] * self.width)]
-        room_seed = self.generate_room_seed(w_seed, cords)
-        generated_tiles = self.generate_noise(room_seed)
-        random = rnd.Random(room_seed)
-        for i, c in rn.items():
-            l_room_seed = self.generate_room_seed(w_seed, c)
-            generated_tiles.update(self.generate_noise(l_room_seed,
-                                                       offset_x=local_rn[i][0],
-                                                       offset_y=local_rn[i][1]))
-        for _ in range(2):
-            for _cords in generated_tiles.keys():
-                c = _neighbors(_cords[0], _cords[1], generated_tiles)
-                if generated_tiles[_cords] and c < 3:
-                    generated_tiles[_cords] = 0
-                    continue
-                elif c >= 6:
-                    generated_tiles[_cords] = 1
-
-        return {cords: check_shape(*cords, generated_tiles) if tile else 0
-                for cords, tile in generated_tiles.items() if cords in self.room_cords}
+            return None
+        x0, y0 = cords[0] * self.width, cords[1] * self.height
+        # Neighbors outside of the room are never counted by the rule, so the halo stays empty. If it ever has to be
+        # filled, noise() can produce it directly from the global coordinates.
+        grid = np.zeros((self.width + 2, self.height + 2), dtype=np.uint8)
+        grid[1:-1, 1:-1] = noise(w_seed, x0, y0, x0 + self.width, y0 + self.height)
+        ca_smooth(grid)
+        return grid[1:-1, 1:-1]
+
+    def generate_region(self, w_seed, x0, y0, x1, y1):
+        """
+            Generate a rectangle of rooms at once, output matches generate() for every room
+
+        :param w_seed: World's seed, see derive_seed()
+        :param x0: X coordinate of the first room
+        :param y0: Y coordinate of the first room
+        :param x1: X coordinate after the last room
+        :param y1: Y coordinate after the last room
+        :return: Generated structures (dict of room's coordinates to uint8 array or None)
+        """
+        output = {(x, y): self.generate(w_seed, (x, y))
+                  for x in range(x0, x1) for y in range(y0, y1) if x < 0 or y < 0}
+        x0, y0 = max(x0, 0), max(y0, 0)
+        if x1 <= x0 or y1 <= y0:
+            return output
+        nx, ny = x1 - x0, y1 - y0
+        # Noise for the whole region is generated once and then cut into rooms, smoothing runs over all rooms
+        # of the region as a single batch.
+        area = noise(w_seed, x0 * self.width, y0 * self.height, x1 * self.width, y1 * self.height)
+        grids = np.zeros((nx, ny, self.width + 2, self.height + 2), dtype=np.uint8)
+        grids[:, :, 1:-1, 1:-1] = area.reshape(nx, self.width, ny, self.height).transpose(0, 2, 1, 3)
+        ca_smooth(grids)
+        for x in range(nx):
+            for y in range(ny):
+                output[x0 + x, y0 + y] = grids[x, y, 1:-1, 1:-1]
+        return output
 
     def run(self) -> None:
         """
             Run the worker
         """
         mp.current_process().name = '_WorldGen'
-        w_seed = int.from_bytes(hashlib.sha256(str(self.seed).encode('utf-8')).digest(), 'little') // \
-                 int.from_bytes(str(self.seed).encode('utf-8'), 'little')
+        w_seed = derive_seed(self.seed)
+        if SimSettings.use_room_cache:
+            self.cache = RoomCache(self.seed, GENERATOR_VERSION, self.room_options.dimensions,
+                                   SimSettings.room_cache_size)
+        self.stats.started.value = time.monotonic()
         i = 0
 
-        for request in iter(self.requests.get, None):
-            i += 1
-            cords = (request[0], request[1])
-            if cords in self.generated:
-                continue
-            generated_tiles = self.generate(w_seed, cords)
-            self.output.put((cords, generated_tiles))
-            self.generated.append(cords)
-            if not (i % 60):
-                gc.collect()
-
+        for request in iter(self.next_request, None):
+            self.stats.busy.value = 1
+            start = time.monotonic()
+            for cords, generated_tiles in self.load(w_seed, request):
+                if cords in self.generated:
+                    continue
+                i += 1
+                self.output.put((cords, -1 if generated_tiles is None else self.slab.write(generated_tiles)))
+                self.generated.add(cords)
+                if not (i % 60):
+                    gc.collect()
+            if self.cache is not None:
+                self.cache.commit()
+            with self.stats.busy_time.get_lock():
+                self.stats.busy_time.value += time.monotonic() - start
+            with self.stats.processed.get_lock():
+                self.stats.processed.value += _request_size(request)
+            self.stats.busy.value = 0
+
+        if self.cache is not None:
+            self.cache.close()
         self.kill()
 
+    def load(self, w_seed, request):
+        """
+            Get rooms of a request from the room cache, generate and cache the missing ones.
+
+        :param w_seed: World's seed, see derive_seed()
+        :param request: Room (x, y) or region (x0, y0, x1, y1) request
+        :return: List of (cords, generated structure) pairs
+        """
+        wanted = [cords for cords in _request_rooms(request) if cords not in self.generated]
+        if self.cache is None:
+            cached = {}
+        elif len(request) == 4:
+            cached = self.cache.get_region(*request)
+        else:
+            grid = self.cache.get(tuple(request))
+            cached = {} if grid is None else {tuple(request): grid}
+        missing = [cords for cords in wanted if cords not in cached and cords[0] >= 0 and cords[1] >= 0]
+        generated = {}
+        if missing:
+            generated = self.generate_region(w_seed, *request) if len(request) == 4 \
+                else {tuple(request): self.generate(w_seed, tuple(request))}
+            if self.cache is not None:
+                [self.cache.put(cords, generated[cords]) for cords in missing]
+        return [(cords, cached[cords] if cords in cached else generated.get(cords)) for cords in wanted]
+
+    def next_request(self):
+        """
+            Get the next request from the worker's queue. If the worker has peers (see _SmartDistributor) and stays
+            idle for steal_after seconds, it takes a request from the most backlogged peer instead.
+
+        :return: Request or None if the worker should stop
+        """
+        while True:
+            try:
+                request = self.requests.get(timeout=self.steal_after) if self.peers else self.requests.get()
+                owner = self.stats
+            except queue.Empty:
+                requests, owner = max(self.peers, key=lambda peer: peer[1].queued.value)
+                if not (owner.queued.value and owner.busy.value):
+                    continue
+                try:
+                    request = requests.get_nowait()
+                except queue.Empty:
+                    continue
+                if request is None:
+                    requests.put(None)
+                    continue
+            if request is not None:
+                owner.add_queued(-_request_size(request))
+            return request
+
     def kill(self):
         pass
 
@@ -213,8 +506,8 @@ class _WorldGenThread(_WorldGen, thr.Thread):
         Thread version of WorldGen class
     """
 
-    def __init__(self, room_options, seed, output):
-        super().__init__(room_options=room_options, seed=seed, output=output)
+    def __init__(self, room_options, seed, output, slab, stats=None):
+        super().__init__(room_options=room_options, seed=seed, output=output, slab=slab, stats=stats)
 
 
 class _WorldGenProcess(_WorldGen, mp.Process):
@@ -222,8 +515,8 @@ class _WorldGenProcess(_WorldGen, mp.Process):
         Process version of WorldGen class
     """
 
-    def __init__(self, room_options, seed, output):
-        super().__init__(room_options=room_options, seed=seed, output=output)
+    def __init__(self, room_options, seed, output, slab, stats=None):
+        super().__init__(room_options=room_options, seed=seed, output=output, slab=slab, stats=stats)
 
 
 class WorldGenHandler:
@@ -245,16 +538,19 @@ class _WorldGenHandler:
         Preferably use WorldGenHandler instead of this (_WorldGenHandler) class.
     """
 
-    def __init__(self, world_options):
+    def __init__(self, world_options, worker=None, workers_amount=1):
         self.requests = mp.Queue()
         self.output = mp.Queue()
         self.world_options = world_options
         self.room_options = ProjSettings.RoomSettings()
         self.seed = self.world_options.seed
-        self.worker = _WorldGenProcess
+        self.worker = worker or _WorldGenProcess
         self.workers = []
-        self.workers_amount = 1
-        self.distributor = SimpleDistributor(self.workers, _WorldGen.request)
+        self.workers_amount = workers_amount
+        self.worker_stats = [WorkerStats() for _ in range(self.workers_amount)]
+        self.view = mp.Array('i', 4)
+        self.slab = RoomSlab(SimSettings.transport_slots, self.room_options.dimensions)
+        self.distributor = SimpleDistributor(self.workers, _submit)
 
     def request(self, x: int, y: int):
         """
@@ -265,22 +561,85 @@ class _WorldGenHandler:
         """
         self.requests.put((x, y))
 
+    def request_region(self, x0: int, y0: int, x1: int, y1: int):
+        """
+            Request a rectangle of rooms to be generated, region is split into blocks of
+            WorldSettings.region_block rooms so it can be spread over the workers.
+
+            :param x0: X coordinate of the first room
+            :param y0: Y coordinate of the first room
+            :param x1: X coordinate after the last room
+            :param y1: Y coordinate after the last room
+        """
+        step = self.world_options.region_block
+        for bx in range(x0, x1, step):
+            for by in range(y0, y1, step):
+                self.requests.put((bx, by, min(bx + step, x1), min(by + step, y1)))
+
+    def focus(self, x0: int, y0: int, x1: int, y1: int):
+        """
+            Set currently visible rooms, pending requests are generated closest to them first.
+            Requests further than SimSettings.request_drop_distance rooms are cancelled, for every cancelled room
+            (cords, None) is put to the output.
+
+            :param x0: X coordinate of the first visible room
+            :param y0: Y coordinate of the first visible room
+            :param x1: X coordinate after the last visible room
+            :param y1: Y coordinate after the last visible room
+        """
+        self.view[:] = [x0, y0, x1, y1]
+
     def halt(self):
         """
             Send a message to all workers to stop the generation process.
         """
         self.requests.put(None)
 
+    def utilisation(self) -> list[dict]:
+        """
+            Report how busy every worker is.
+
+            :return: List of per-worker counters: queued and processed rooms, utilisation (0..1)
+        """
+        return [{'queued': stats.queued.value, 'processed': stats.processed.value,
+                 'utilisation': stats.utilisation()} for stats in self.worker_stats]
+
+    def schedule(self):
+        """
+            Pass requests to the workers closest to the view first, only as many as the workers can take right away.
+        """
+        scheduler = RequestScheduler(SimSettings.request_drop_distance)
+        capacity = self.workers_amount * SimSettings.request_distributor_capacity
+        while True:
+            try:
+                request = self.requests.get(timeout=.01) if scheduler else self.requests.get()
+                while request is not None:
+                    scheduler.push(request)
+                    request = self.requests.get_nowait()
+                break
+            except queue.Empty:
+                pass
+            for dropped in scheduler.set_view(self.view[:]):
+                [self.output.put((cords, None)) for cords in _request_rooms(dropped)]
+            while scheduler and sum(stats.load for stats in self.worker_stats) < capacity:
+                self.distributor(*scheduler.pop())
+
     def run(self) -> None:
         """
             Run the handler
         """
         mp.current_process().name = "WorldGenHandler"
-        self.workers = [self.worker(self.room_options, self.seed, self.output)
-                        for _ in range(self.workers_amount)]
-        self.distributor = SimpleDistributor(self.workers, _WorldGen.request)
+        self.workers = [self.worker(self.room_options, self.seed, self.output, self.slab, stats)
+                        for stats in self.worker_stats]
+        if SimSettings.use_smart_request_distributor:
+            self.distributor = _SmartDistributor(self.workers, _submit, lambda worker: worker.stats.load,
+                                                 SimSettings.request_distributor_capacity)
+            for worker in self.workers:
+                worker.peers = [(peer.requests, peer.stats) for peer in self.workers if peer is not worker]
+        else:
+            self.distributor = SimpleDistributor(self.workers, _submit)
         [worker.start() for worker in self.workers]
-        [self.distributor(*request) for request in iter(self.requests.get, None)]
+        self.schedule()
         [worker.requests.put(None) for worker in self.workers]
         [worker.join() for worker in self.workers]
 
@@ -293,9 +652,8 @@ class WorldGenHandlerProcess(_WorldGenHandler, mp.Process):
 
     def __init__(self, world_options):
         mp.Process.__init__(self)
-        _WorldGenHandler.__init__(self, world_options)
-        self.worker = _WorldGenThread
-        self.workers_amount = self.world_options.generator_threads
+        _WorldGenHandler.__init__(self, world_options, worker=_WorldGenThread,
+                                  workers_amount=world_options.generator_threads)
 
 
 class WorldGenHandlerThread(_WorldGenHandler, thr.Thread):
@@ -306,5 +664,5 @@ class WorldGenHandlerThread(_WorldGenHandler, thr.Thread):
 
     def __init__(self, world_options):
         thr.Thread.__init__(self)
-        _WorldGenHandler.__init__(self, world_options)
-        self.workers_amount = self.world_options.generator_processes
+        _WorldGenHandler.__init__(self, world_options, worker=_WorldGenProcess,
+                                  workers_amount=world_options.generator_processes)